@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+""" Generate a synthetic PEP with looper results, for benchmarking caravel on large projects """
+
+import argparse
+import os
+import random
+
+PIPELINE_NAME = "BENCH_PIPELINE"
+PROTOCOLS = ["RNA-seq", "ATAC-seq"]
+# fraction of the samples in each state, the samples with no flag were not submitted
+STATE_WEIGHTS = [("completed", 0.7), ("running", 0.1), ("failed", 0.05), ("waiting", 0.05), (None, 0.1)]
+N_STATS = 10
+N_OBJECTS = 2
+SUBPROJECT_FRACTION = 0.5
+
+CONFIG_TEMPLATE = """name: {name}
+metadata:
+    output_dir: {output_dir}
+    sample_table: samples.csv
+    pipeline_interfaces: ../pipeline_interface.yaml
+
+derived_attributes: data_source
+data_sources:
+    path: "../data/{{filename}}"
+
+subprojects:
+    half:
+        metadata:
+            sample_table: samples_half.csv
+"""
+
+PIFACE_TEMPLATE = """protocol_mapping:
+{mapping}
+
+pipelines:
+    bench_pipeline:
+        name: {pipeline_name}
+        path: pipeline/bench_pipeline.py
+        looper_args: True
+        required_input_files: [data_source]
+        arguments:
+            "--sample-name": sample_name
+            "--input": data_source
+        resources:
+            default:
+                file_size: "0"
+                cores: "1"
+                mem: "4000"
+                time: "00-01:00:00"
+"""
+
+
+def generate_pep(root, n_samples, name=None, seed=0):
+    """
+    Generate a synthetic PEP: the project config with a subproject, sample tables, pipeline interface
+    and the looper results folder with the flag files and the per-sample stats and objects files
+
+    :param str root: the directory to create the project in
+    :param int n_samples: number of the samples
+    :param str name: the project name
+    :param int seed: the random generator seed, the same seed results in the same project
+    :return str: path to the project config file
+    """
+    rng = random.Random(seed)
+    name = name or "bench_{}".format(n_samples)
+    metadata_dir = os.path.join(root, "metadata")
+    output_dir = os.path.join(root, "output")
+    results_dir = os.path.join(output_dir, "results_pipeline")
+    for d in [metadata_dir, results_dir, os.path.join(root, "data"), os.path.join(root, "pipeline")]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    with open(os.path.join(root, "pipeline_interface.yaml"), "w") as f:
+        f.write(PIFACE_TEMPLATE.format(pipeline_name=PIPELINE_NAME,
+                                       mapping="\n".join("    {}: bench_pipeline".format(p) for p in PROTOCOLS)))
+    config_path = os.path.join(metadata_dir, "config.yaml")
+    with open(config_path, "w") as f:
+        f.write(CONFIG_TEMPLATE.format(name=name, output_dir=output_dir))
+    states, weights = zip(*STATE_WEIGHTS)
+    header = "sample_name,protocol,filename,data_source\n"
+    with open(os.path.join(metadata_dir, "samples.csv"), "w") as table, \
+            open(os.path.join(metadata_dir, "samples_half.csv"), "w") as half_table:
+        table.write(header)
+        half_table.write(header)
+        for i in range(n_samples):
+            sample = "sample{:06d}".format(i)
+            row = "{},{},{}.fastq.gz,path\n".format(sample, rng.choice(PROTOCOLS), sample)
+            table.write(row)
+            if rng.random() < SUBPROJECT_FRACTION:
+                half_table.write(row)
+            state = rng.choices(states, weights)[0]
+            if state is not None:
+                _write_sample_results(os.path.join(results_dir, sample), state, rng)
+    return config_path
+
+
+def _write_sample_results(sample_dir, state, rng):
+    """
+    Write the flag file of the sample and, for the completed samples, the stats and objects files
+
+    :param str sample_dir: the sample results folder
+    :param str state: the sample state
+    :param random.Random rng: the random generator
+    """
+    os.makedirs(sample_dir)
+    open(os.path.join(sample_dir, "{}_{}.flag".format(PIPELINE_NAME, state)), "w").close()
+    if state != "completed":
+        return
+    with open(os.path.join(sample_dir, "stats.tsv"), "w") as f:
+        for i in range(N_STATS):
+            f.write("stat{}\t{:.3f}\t{}\n".format(i, rng.uniform(0, 1000), PIPELINE_NAME))
+        f.write("Time\t{}:{:02d}:{:02d}\t{}\n".format(rng.randint(0, 5), rng.randint(0, 59), rng.randint(0, 59),
+                                                       PIPELINE_NAME))
+        f.write("Peak memory\t{:.2f} GB\t{}\n".format(rng.uniform(0.5, 16), PIPELINE_NAME))
+    with open(os.path.join(sample_dir, "objects.tsv"), "w") as f:
+        for i in range(N_OBJECTS):
+            f.write("plot{i}\tplot{i}.pdf\tPlot {i}\tplot{i}.png\t{pl}\n".format(i=i, pl=PIPELINE_NAME))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PEP with looper results")
+    parser.add_argument("root", help="The directory to create the project in.")
+    parser.add_argument("-n", "--samples", type=int, default=1000, help="Number of the samples.")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="The random generator seed.")
+    args = parser.parse_args()
+    print(generate_pep(args.root, args.samples, seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
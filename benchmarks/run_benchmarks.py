@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+Time the caravel hot paths end to end, through the Flask test client, on synthetic projects of increasing size.
+The results are written to a JSON file, so they can be compared across versions
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from generate_pep import generate_pep
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+TOKEN = "benchmarktoken"
+JOB_TIMEOUT = 3600  # in seconds
+JOB_POLL_INTERVAL = 0.5  # in seconds
+
+
+def _time(func, repeat):
+    """
+    Call the function a number of times and time the calls
+
+    :param callable func: the function to time, returns the response
+    :param int repeat: number of the calls
+    :return dict: the call times, in seconds, and their summary; the first call is the cold one
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        r = func()
+        times.append(time.perf_counter() - start)
+        if r.status_code >= 400:
+            raise RuntimeError("Request failed with status {}: {}".format(r.status_code, r.get_data(as_text=True)[:500]))
+    return {"times": times, "cold": times[0], "median": statistics.median(times), "min": min(times)}
+
+
+def _wait_for_job(client):
+    """
+    Wait for the most recently submitted job to finish
+
+    :param flask.testing.FlaskClient client: the test client
+    :return dict: the job data
+    """
+    job = client.get("/_background_jobs").get_json()["jobs"][-1]
+    deadline = time.time() + JOB_TIMEOUT
+    while job["state"] in ["queued", "running"] and time.time() < deadline:
+        time.sleep(JOB_POLL_INTERVAL)
+        job = client.get("/_background_job/{}".format(job["id"])).get_json()["job"]
+    return job
+
+
+def benchmark_project(config_path, workdir, repeat):
+    """
+    Time the hot paths for a single project, in a fresh application state
+
+    :param str config_path: path to the project config file
+    :param str workdir: the directory to write the caravel config to
+    :param int repeat: number of the calls of each step
+    :return dict: timings by step
+    """
+    import caravel.caravel as caravel_app
+    caravel_config = os.path.join(workdir, "caravel.yaml")
+    with open(caravel_config, "w") as f:
+        f.write("config_version: 0.2\nprojects:\n  {}: {{}}\n".format(config_path))
+    app = caravel_app.configure_app(config=caravel_config,
+                                    status_history=os.path.join(workdir, "status_history.sqlite"))
+    caravel_app.login_token = TOKEN
+    client = app.test_client()
+    results = dict()
+    results["index"] = _time(lambda: client.get("/index?token={}".format(TOKEN)), repeat)
+    results["dashboard"] = _time(lambda: client.get("/_background_dashboard?refresh=1"), repeat)
+    results["index_populate"] = _time(lambda: client.get("/index?populate=1"), repeat)
+    with client.session_transaction() as session:
+        csrf = session["_csrf_token"]
+    form = {"_csrf_token": csrf, "select_project": "{};1".format(config_path)}
+    results["process"] = _time(lambda: client.post("/process", data=form), repeat)
+    results["check_status"] = _time(lambda: client.get("/_background_check_status"), repeat)
+    results["status_summary"] = _time(lambda: client.get("/_background_status_summary"), repeat)
+    results["status_rows"] = _time(lambda: client.get("/_background_status_rows?offset=0&limit=100"), repeat)
+    results["status_rows_sorted"] = _time(
+        lambda: client.get("/_background_status_rows?offset=0&limit=100&sort=status&order=desc"), repeat)
+    results["resources"] = _time(lambda: client.get("/resources"), repeat)
+    results["resources_refresh"] = _time(lambda: client.get("/resources?refresh=1"), repeat)
+    results["options"] = _time(lambda: client.get("/_background_options?act=summarize"), repeat)
+
+    def _summarize():
+        r = client.post("/action", data={"_csrf_token": csrf})
+        job = _wait_for_job(client)
+        if job["state"] != "completed":
+            raise RuntimeError("Summarize job {}: {}".format(job["state"], job["error"]))
+        return r
+
+    results["summarize"] = _time(_summarize, repeat)
+    client.get("/summary")
+    # the navbar summary links are rendered on the project page once the summary was requested
+    results["navbar"] = _time(lambda: client.get("/process"), repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark caravel on synthetic projects")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Numbers of the samples in the benchmarked projects.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of the calls of each step.")
+    parser.add_argument("-o", "--output", default="caravel_benchmarks.json", help="The results JSON file.")
+    parser.add_argument("-w", "--workdir", help="The directory to generate the projects in, kept afterwards. "
+                                                "If not provided, a temporary one is used and removed.")
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    from caravel._version import __version__
+    from caravel.const import LOOPER_VERSION
+    workdir = args.workdir or tempfile.mkdtemp(prefix="caravel_bench_")
+    report = {"caravel_version": __version__, "looper_version": LOOPER_VERSION,
+              "python_version": platform.python_version(), "platform": platform.platform(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": args.repeat, "results": dict()}
+    try:
+        for n in args.sizes:
+            root = os.path.join(workdir, "bench_{}".format(n))
+            config_path = os.path.join(root, "metadata", "config.yaml")
+            if os.path.exists(config_path):
+                print("Using the existing project: {}".format(config_path))
+            else:
+                start = time.perf_counter()
+                generate_pep(root, n)
+                print("Generated {} samples in {:.1f}s: {}".format(n, time.perf_counter() - start, config_path))
+            results = benchmark_project(config_path, root, args.repeat)
+            for step, timing in results.items():
+                print("  {:<16} cold {:8.3f}s  median {:8.3f}s".format(step, timing["cold"], timing["median"]))
+            report["results"][str(n)] = results
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to: {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
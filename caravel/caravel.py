@@ -1,24 +1,46 @@
 """ Main UI application for using looper """
 
-from functools import wraps
+from collections import OrderedDict
+from functools import partial, wraps
 import getpass
+import hashlib
+import json
+import signal
+import tempfile
+import threading
+import time
 import traceback
 import warnings
 from yaml import safe_load
-from flask import Flask, render_template, request, jsonify, session, redirect, send_from_directory, url_for, flash
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, send_from_directory, url_for, \
+    flash, g
 import globs
 from .const import *
 from .helpers import *
 from .looper_parser import *
-import divvy
-from textile import textile
+from .dashboard import DASHBOARD
+from .eta import get_estimator
+from .flag_index import add_change_listener, get_flag_index, remove_change_listener
+from .jobs import JobManager
+from .metrics import METRICS
+from .profiler import REQUEST_PROFILER, collapsed_stacks, flamegraph_svg, package_summary, sample_stacks
+from .project_cache import project_fingerprint
+from .resources import resource_report
+from .server import serve
+from .session_context import current_context, get_contexts, init_contexts
+from .state_store import StateStore
+from .status_history import StatusHistory
+from .status_rows import status_row_classes, status_rows, status_summary
 from platform import python_version
-from looper.project import Project
-from looper.html_reports import *
 from ubiquerg import is_collection_like
 
 
 app = Flask(__name__, template_folder=TEMPLATES_PATH)
+# rendered action options fragments, by project, subproject, action and session
+_options_cache = OrderedDict()
+_options_cache_lock = threading.Lock()
+# modification times and content hashes of the static files, by file name
+_static_hashes = dict()
 
 
 def clear_session_data(keys):
@@ -88,12 +110,35 @@ def token_required(func):
     return decorated
 
 
+def _stop_services(wait=False):
+    """
+    Stop accepting the jobs and cancel the queued ones, write the delayed caravel config changes
+    and the buffered status transitions
+
+    :param bool wait: whether to wait for the running jobs to finish
+    """
+    if globs.jobs is not None:
+        globs.jobs.shutdown(wait=wait)
+    if globs.cc is not None:
+        globs.cc.flush()
+    if globs.status_history is not None:
+        globs.status_history.flush()
+
+
 @token_required
 def shutdown_server():
+    if app.config.get("workers"):
+        # stop the gunicorn arbiter, which stops the workers gracefully; each one stops its services on exit
+        app.logger.info("Shutting down...")
+        _stop_services()
+        clear_session_data(keys=['token', '_csrf_token'])
+        os.kill(os.getppid(), signal.SIGTERM)
+        return
     shut_func = request.environ.get('werkzeug.server.shutdown')
     if shut_func is None:
         raise RuntimeError('Not running with the Werkzeug Server')
     app.logger.info("Shutting down...")
+    _stop_services()
     clear_session_data(keys=['token', '_csrf_token'])
     shut_func()
 
@@ -126,6 +171,16 @@ def shutdown():
     return 'Server was shut down successfully'
 
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.before_request
+def start_request_profile():
+    g.profiled = REQUEST_PROFILER.start(request.endpoint)
+
+
 @app.before_request
 def csrf_protect():
     if request.method == "POST":
@@ -135,20 +190,135 @@ def csrf_protect():
             return render_error_msg("The CSRF token is invalid")
 
 
+@app.before_request
+def reload_changed_config():
+    """
+    Reload the caravel config if it was changed by another worker, when caravel is served by multiple workers
+    """
+    if not app.config.get("workers") or globs.cc is None:
+        return
+    try:
+        mtime = os.path.getmtime(globs.cc._file_path)
+    except (OSError, TypeError):
+        mtime = None
+    if mtime != globs.cc_mtime:
+        globs.cc = parse_config_file()
+        globs.cc_mtime = mtime
+
+
+@app.after_request
+def save_session_context(r):
+    """
+    Store the changes of the session context made while handling the request
+    """
+    if "ctx" in g:
+        get_contexts().save(g.ctx)
+    return r
+
+
+@app.after_request
+def stop_request_profile(r):
+    if g.get("profiled"):
+        REQUEST_PROFILER.stop()
+        app.logger.info("Request to '{}' profiled".format(request.endpoint))
+    return r
+
+
+@app.after_request
+def record_request_metrics(r):
+    """
+    Record the request handling time in the metrics and log the slow requests
+    """
+    if "request_start" not in g:
+        return r
+    duration = time.perf_counter() - g.request_start
+    METRICS.observe_request(request.endpoint or "unknown", request.method, r.status_code, duration)
+    threshold = globs.slow_request_threshold or SLOW_REQUEST_THRESHOLD
+    if duration > threshold:
+        app.logger.warning("Slow request: {} {} took {:.2f}s".format(request.method, request.full_path, duration))
+    return r
+
+
 @app.after_request
 def add_header(r):
     """
-    Add headers to force the browser not to cache the pages
+    Set the caching policy: the fingerprinted static files are cached for long, the other responses are revalidated
+    every time they are used, which is cheap if they have an ETag.
 
-    This is relevant for serving the summary pages for multiple projects one after another
+    The revalidation is relevant for serving the summary pages for multiple projects one after another,
+    the ETags of the files from different projects differ
     """
-    r.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    r.headers["Pragma"] = "no-cache"
-    r.headers["Expires"] = "0"
-    r.headers["Cache-Control"] = 'public, max-age=0'
+    if request.endpoint == "static" and request.args.get("v") is not None \
+            and request.args.get("v") == static_file_hash(request.view_args.get("filename")):
+        r.headers["Cache-Control"] = "public, max-age={}, immutable".format(STATIC_MAX_AGE)
+    elif request.endpoint != "stream_status":
+        r.headers["Cache-Control"] = "no-cache"
     return r
 
 
+def static_file_hash(filename):
+    """
+    Get the hash of the static file content, it is recomputed only when the file changes
+
+    :param str filename: name of the file in the static folder
+    :return str | None: the content hash, None if the file does not exist
+    """
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+    cached = _static_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = (mtime, hashlib.md5(f.read()).hexdigest()[:STATIC_HASH_LEN])
+        _static_hashes[filename] = cached
+    return cached[1]
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """
+    Add the content hash to the static file URLs, so the files can be cached for long and are
+    downloaded again only when they change
+    """
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        file_hash = static_file_hash(values["filename"])
+        if file_hash is not None:
+            values["v"] = file_hash
+
+
+def conditional_jsonify(*args, **kwargs):
+    """
+    Create a JSON response with the ETag computed from its content.
+    If the client already has the same content, an empty 304 response is returned instead
+
+    :return flask.Response: the response
+    """
+    r = jsonify(*args, **kwargs)
+    r.add_etag()
+    return r.make_conditional(request)
+
+
+def versioned_jsonify(version, build):
+    """
+    Create a JSON response with the ETag computed from the version of its content, so the content is not built
+    if the client already has it: an empty 304 response is returned instead
+
+    :param version: any value with a stable repr that changes whenever the content does
+    :param callable() -> dict build: builds the JSON response content
+    :return flask.Response: the response
+    """
+    etag = hashlib.md5(repr(version).encode()).hexdigest()
+    if etag in request.if_none_match:
+        r = app.response_class(status=304)
+        r.set_etag(etag)
+        return r
+    r = jsonify(**build())
+    r.set_etag(etag)
+    return r.make_conditional(request)
+
+
 def parse_token_file(path=TOKEN_FILE_NAME):
     """
     Get the token from the hidden dotfile
@@ -198,10 +368,14 @@ def gdsv(s):
 
 @app.context_processor
 def inject_dict_for_all_templates():
-    if globs.summary_links is None:
-        globs.summary_links = SUMMARY_NAVBAR_PLACEHOLDER
+    ctx = current_context()
+    if ctx.summary_links is None:
+        if ctx.p is None:
+            ctx.summary_links = SUMMARY_NAVBAR_PLACEHOLDER
+        else:
+            get_navbar_summary_links(ctx)
     return dict(caravel_version=CARAVEL_VERSION, looper_version=LOOPER_VERSION, python_version=python_version(),
-                referrer=request.referrer, debug=app.config["DEBUG"], summary_links=globs.summary_links,
+                referrer=request.referrer, debug=app.config["DEBUG"], summary_links=ctx.summary_links,
                 login=app.config['login'])
 
 
@@ -214,10 +388,12 @@ app.jinja_env.globals['csrf_token'] = generate_csrf_token
 @app.route("/index")
 @token_required
 def index():
-    get_navbar_summary_links()
+    ctx = current_context()
+    get_navbar_summary_links(ctx)
     if request.args.get('reset'):
         globs.init_globals()
-        globs.summary_links = SUMMARY_NAVBAR_PLACEHOLDER
+        ctx.purge()
+        ctx.summary_links = SUMMARY_NAVBAR_PLACEHOLDER
         app.logger.info("Project data removed")
     globs.cc = globs.cc or parse_config_file()
     read_preferences()
@@ -226,19 +402,28 @@ def index():
     subproject = request.args.get('sp')
     app.logger.debug("Selected project:subproject bundle -- {}:{} of types {}:{}"
                      .format(project, subproject, project.__class__.__name__, subproject.__class__.__name__))
+    workers = globs.metadata_workers or METADATA_WORKERS
+    metadata = None
+    if request.args.get('populate') and project is None and workers > 1:
+        # collect the metadata of all the projects in parallel before the config is locked
+        metadata = collect_project_metadata(globs.cc.list_projects(), sp=subproject, workers=workers)
     with globs.cc as x:
         if request.args.get('remove'):
             x.remove_project(path=project, sp=subproject)
         if request.args.get('populate'):
-            x.populate_project_metadata(paths=project, sp=subproject)
+            if metadata is not None:
+                x.merge_project_metadata(metadata)
+            else:
+                x.populate_project_metadata(paths=project, sp=subproject)
         if request.args.get('clear'):
-            globs.purge_project_data()
+            ctx.purge()
             x.populate_project_metadata(clear=True)
     if missing_projs:
         app.logger.warning("{} projects configs not found: {}".format(len(missing_projs), ", ".join(missing_projs)))
     app.logger.debug(globs.cc)
     return render_template('index.html', missing_projects=missing_projs, cc=globs.cc.filter_missing(),
-                           selected=globs.selected_project, selected_id=globs.selected_project_id)
+                           selected=ctx.selected_project, selected_id=ctx.selected_project_id,
+                           status_classes=status_row_classes())
 
 
 @app.route('/_background_exec')
@@ -254,6 +439,8 @@ def background_exec():
 @token_required
 def set_comp_env():
     global active_settings
+    import divvy
+    from divvy.const import COMPUTE_SETTINGS_VARNAME
     if globs.compute_config is None:
         globs.compute_config = divvy.ComputingConfiguration()
     selected_package = request.args.get('compute', type=str)
@@ -287,73 +474,92 @@ def set_comp_env():
 @app.route("/process", methods=['GET', 'POST'])
 @token_required
 def process():
-    from looper import build_parser as blp
-    actions = get_positional_args(blp(), sort=True)
+    ctx = current_context()
+    actions = get_positional_args(get_looper_parser(), sort=True)
     try:
-        globs.selected_project, globs.selected_project_id, globs.current_subproj = \
-            select_project(request.form.get('select_project'))
+        ctx.selected_project, ctx.selected_project_id, ctx.current_subproj = \
+            select_project(ctx, request.form.get('select_project'))
     except TypeError:
         app.logger.info("No project selected, redirecting to the index page.")
         flash("No project was selected, choose one from the list below.")
         return redirect(url_for('index'))
-    config_file = str(os.path.expandvars(os.path.expanduser(globs.selected_project)))
-    if globs.p is None:
-        globs.p = Project(config_file, subproject=globs.current_subproj)
+    if ctx.p is None:
+        ctx.load_project()
     try:
         # subproject related logic can be removed with the introduction of direct subproject selection in the index
-        subprojects = globs.p.subprojects.keys()
+        subprojects = ctx.p.subprojects.keys()
     except AttributeError:
         subprojects = None
     # populating project/subproject metadata and date are treated individually since when the project is activated
     # we want its subprojects data to be populated but not the dates
     with globs.cc as x:
-        x.populate_project_metadata(paths=globs.selected_project,
-                                           sp=globs.current_subproj if globs.current_subproj else None)
-        x.project_date(globs.selected_project, globs.current_subproj)
-    get_navbar_summary_links()
-    return render_template('process.html', p_info=project_info_dict(globs.p), change=None,
-                           selected_subproject=globs.p.subproject, actions=actions, subprojects=subprojects,
-                           interval=globs.status_check_interval)
+        x.populate_project_metadata(paths=ctx.selected_project,
+                                    sp=ctx.current_subproj if ctx.current_subproj else None)
+        x.project_date(ctx.selected_project, ctx.current_subproj)
+    # start watching the flag files, so the first status check does not have to wait for the scan
+    get_flag_index(ctx.p)
+    get_navbar_summary_links(ctx)
+    return render_template('process.html', p_info=project_info_dict(ctx.p), change=None,
+                           selected_subproject=ctx.p.subproject, actions=actions, subprojects=subprojects,
+                           interval=globs.status_check_interval, stream=not app.config.get("workers"),
+                           row_height=STATUS_ROW_HEIGHT, page_size=STATUS_PAGE_SIZE, eta_interval=ETA_REFRESH,
+                           status_classes=status_row_classes())
 
 
 @app.route('/_background_subproject')
 def background_subproject():
+    ctx = current_context()
     sp = request.args.get('sp', type=str)
     output = "Activated subproject: " + sp
     if sp == "None":
-        globs.p.deactivate_subproject()
+        ctx.current_subproj = None
+        ctx.load_project()
     else:
-        globs.p.activate_subproject(sp)
-        globs.run = False
-        globs.current_subproj = sp
-        globs.cc.project_date(globs.selected_project, globs.current_subproj)
-    globs.summary_requested = None
-    get_navbar_summary_links()
-    return jsonify(subproj_txt=output, p_info=project_info_dict(globs.p), navbar_links=globs.summary_links)
+        ctx.current_subproj = sp
+        ctx.load_project()
+        ctx.run = False
+        globs.cc.project_date(ctx.selected_project, ctx.current_subproj)
+    ctx.summary_requested = None
+    get_navbar_summary_links(ctx)
+    return jsonify(subproj_txt=output, p_info=project_info_dict(ctx.p), navbar_links=ctx.summary_links)
 
 
 @app.route('/_background_options')
 def background_options():
-    from looper.looper import build_parser as blp
-    globs.act = request.args.get('act', type=str) or "run"
-    parser_looper = blp()
-    form_elements_data = get_form_elements_data(parser_looper, globs.p, globs.act)
-    globs.dests = form_elements_data[2]
-    grouped_data = form_elements_data_by_type(form_elements_data)
-    return jsonify(options=render_template('options.html', grouped_form_data=grouped_data))
+    ctx = current_context()
+    ctx.act = request.args.get('act', type=str) or "run"
+    # the form includes the session CSRF token, so the rendered fragments are cached per session as well
+    key = (ctx.p.config_file, ctx.p.subproject, ctx.act, project_fingerprint(ctx.p), session.get('_csrf_token'))
+    with _options_cache_lock:
+        cached = _options_cache.get(key)
+        if cached is not None:
+            _options_cache.move_to_end(key)
+    if cached is not None:
+        ctx.dests, options = cached
+    else:
+        form_elements_data = get_form_elements_data(get_looper_parser(), ctx.p, ctx.act)
+        grouped_data = form_elements_data_by_type(form_elements_data)
+        options = render_template('options.html', grouped_form_data=grouped_data)
+        ctx.dests = form_elements_data[2]
+        with _options_cache_lock:
+            _options_cache[key] = (ctx.dests, options)
+            while len(_options_cache) > OPTIONS_CACHE_SIZE:
+                _options_cache.popitem(last=False)
+    return conditional_jsonify(options=options)
 
 
 @app.route('/summary', methods=['GET'])
 @token_required
 def summary():
-    globs.summary_requested = True
-    if globs.selected_project is None:
+    ctx = current_context()
+    ctx.summary_requested = True
+    if ctx.selected_project is None:
         app.logger.info("The project is not selected, redirecting to the index page.")
         flash("No project was selected, choose one from the list below.")
         return redirect(url_for('index'))
-    summary_html_name = get_summary_html_name(globs.p)
-    summary_location = os.path.join(globs.p.metadata.output_dir, summary_html_name)
-    if check_for_summary(globs.p):
+    summary_html_name = get_summary_html_name(ctx.p)
+    summary_location = os.path.join(ctx.p.metadata.output_dir, summary_html_name)
+    if check_for_summary(ctx.p):
         summary_string = "summary/{}".format(summary_html_name)
         return redirect(summary_string)
     else:
@@ -363,16 +569,43 @@ def summary():
         return redirect(request.referrer)
 
 
+@app.route('/resources', methods=['GET'])
+@token_required
+def resources():
+    """
+    Show the resource usage of the selected project: the total core-hours of the project and its subprojects
+    and the samples which wall time or peak memory use is unusual for their pipeline and protocol
+    """
+    ctx = current_context()
+    if ctx.selected_project is None:
+        app.logger.info("The project is not selected, redirecting to the index page.")
+        flash("No project was selected, choose one from the list below.")
+        return redirect(url_for('index'))
+    if ctx.p is None:
+        ctx.load_project()
+    try:
+        sp_names = ctx.p.subprojects.keys() if ctx.p.subproject is None else []
+    except AttributeError:
+        sp_names = []
+    # only the names, results folders and sample names of the subprojects are needed, so the subproject Projects
+    # are not loaded into the project cache, where they would evict the ones in use
+    subprojects = {sp: DASHBOARD.describe(ctx.config_path, sp) for sp in sp_names}
+    report = resource_report(ctx.p, subprojects=subprojects, refresh=request.args.get("refresh", type=int) == 1)
+    get_navbar_summary_links(ctx)
+    return render_template('resources.html', p_info=project_info_dict(ctx.p), report=report)
+
+
 @app.route("/summary/<path:filename>", methods=['GET'])
 @token_required
 def serve_static(filename):
-    return send_from_directory(globs.p.output_dir, filename)
+    return send_from_directory(current_context().p.output_dir, filename, conditional=True)
 
 
 @app.route("/action", methods=['GET', 'POST'])
 @token_required
 def action():
-    if globs.act == "summarize" and not check_if_run(globs.p):
+    ctx = current_context()
+    if ctx.act == "summarize" and not check_if_run(ctx.p):
         msg = "No samples were run yet, there's no point in summarizing"
         current_app.logger.warning(msg)
         flash(msg)
@@ -380,48 +613,261 @@ def action():
     args = argparse.Namespace()
     args_dict = vars(args)
     # Set the arguments from the forms
-    for arg in globs.dests:
+    for arg in ctx.dests:
         value = convert_value(request.form.get(arg))
         args_dict[arg] = value
     # hardcode upfront confirmation in the yes/no query; used in clean and destroy actions
     args_dict["force_yes"] = True
-    if globs.log_path is None:
-        globs.log_path = os.path.join(globs.p.output_dir, LOG_FILENAME)
-    args_dict["logfile"] = globs.log_path
+    if ctx.log_path is None:
+        ctx.log_path = os.path.join(ctx.p.output_dir, LOG_FILENAME)
+    args_dict["logfile"] = ctx.log_path
     # perform necessary changes so the looper understands the Namespace
     args_dict = parse_namespace(args_dict)
-    # establish the looper log path
-    # set the selected computing environment in the Project object
-    try:
-        globs.p.dcc.activate_package(globs.compute_package)
-    except NameError:
+    # the Project object is shared by the sessions, so the selected computing environment is activated by the job
+    compute_package = globs.compute_package
+    if compute_package is None:
         app.logger.info("The compute package was not selected, using 'default'.")
-        globs.p.dcc.activate_package("default")
-    # run looper action
-    run_looper(prj=globs.p, args=args, act=globs.act, log_path=globs.log_path, logging_lvl=globs.logging_lvl)
-    get_navbar_summary_links()
-    return render_template("/execute.html")
+        compute_package = "default"
+    # run looper action in the background
+    job = globs.jobs.submit(_run_action, ctx.selected_project, ctx.act, prj=ctx.p, args=args, act=ctx.act,
+                            log_path=ctx.log_path, logging_lvl=globs.logging_lvl, ctx=ctx,
+                            compute_package=compute_package)
+    app.logger.info("Submitted '{}' action as job {}".format(ctx.act, job.id))
+    return render_template("/execute.html", job_id=job.id, act=ctx.act, log_path=ctx.log_path)
+
+
+def _run_action(ctx, cancel_event, **kwargs):
+    """
+    Run looper action, then refresh the navbar summary links and store the session context changes.
+    Executed by the job manager
+
+    :param caravel.session_context.SessionContext ctx: context of the session the action was submitted in
+    :param threading.Event cancel_event: the job cancellation request
+    """
+    run_looper(ctx=ctx, cancel_event=cancel_event, **kwargs)
+    get_navbar_summary_links(ctx)
+    get_contexts().save(ctx)
+
+
+@app.route('/_background_jobs')
+def background_jobs():
+    return conditional_jsonify(jobs=globs.jobs.describe_all())
+
+
+@app.route('/_background_job/<job_id>')
+def background_job(job_id):
+    job = globs.jobs.describe(job_id)
+    if job is None:
+        return jsonify(error="Job '{}' not found".format(job_id)), 404
+    return conditional_jsonify(job=job)
+
+
+@app.route('/_cancel_job/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    if globs.jobs.describe(job_id) is None:
+        return jsonify(error="Job '{}' not found".format(job_id)), 404
+    cancelled = globs.jobs.cancel(job_id)
+    app.logger.info("Job {} cancellation {}".format(job_id, "requested" if cancelled else "failed"))
+    return jsonify(cancelled=cancelled, job=globs.jobs.describe(job_id))
 
 
 @app.route('/_background_check_status')
 def background_check_status():
-    app.logger.info("checking flags for {} samples".format(len(list(globs.p.sample_names))))
-    flags = get_sample_flags(globs.p, list(globs.p.sample_names))
-    if all(not value for value in flags.values()) and not globs.run:
-        return jsonify(status_table="No samples were processed yet. " \
-                                    "Use <code>looper run</code> and then check the status",
-                       interval=globs.status_check_interval)
-    elif any(value for value in flags.values()):
-        return jsonify(status_table=create_status_table(globs.p, final=False) + sample_info_hint(globs.p),
-                       interval=globs.status_check_interval)
-    else:
-        return jsonify(status_table=MISSING_SAMPLE_DATA_TXT, interval=globs.status_check_interval)
+    ctx = current_context()
+    summary = status_summary(ctx.p, recent=0)
+    app.logger.info("checking flags for {} samples".format(summary["total"]))
+    any_flags = summary["counts"].get("Missing", 0) < summary["total"]
+    idx = get_flag_index(ctx.p)
+    # the table changes with the flags; the runtimes of the running samples are refreshed every so often
+    refreshed = int(time.time() // STATUS_TABLE_REFRESH) if summary["counts"].get("Running") else None
+    version = (project_fingerprint(ctx.p), ctx.p.subproject, idx.results_dir, idx.created, summary["version"],
+               refreshed, any_flags, bool(ctx.run), check_for_summary(ctx.p), globs.status_check_interval)
+
+    def _build():
+        from looper.html_reports import create_status_table
+        if not any_flags and not ctx.run:
+            table = "No samples were processed yet. Use <code>looper run</code> and then check the status"
+        elif any_flags:
+            table = create_status_table(ctx.p, final=False) + sample_info_hint(ctx.p)
+        else:
+            table = MISSING_SAMPLE_DATA_TXT
+        return dict(status_table=table, interval=globs.status_check_interval)
+
+    return versioned_jsonify(version, _build)
+
+
+@app.route('/_background_status_rows')
+def background_status_rows():
+    """
+    Get a page of the sample status rows, sorted and filtered on the server side,
+    so the payload size does not depend on the number of the samples in the project
+    """
+    ctx = current_context()
+    try:
+        data = status_rows(ctx.p, offset=request.args.get('offset', default=0, type=int),
+                           limit=request.args.get('limit', default=STATUS_PAGE_SIZE, type=int),
+                           sort=request.args.get('sort', default="index"),
+                           order=request.args.get('order', default="asc"),
+                           status=request.args.get('status'), prefix=request.args.get('prefix'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    message = None
+    if data["counts"].get("Missing", 0) == data["total"]:
+        message = MISSING_SAMPLE_DATA_TXT if ctx.run else \
+            "No samples were processed yet. Use <code>looper run</code> and then check the status"
+    return conditional_jsonify(message=message, hint=sample_info_hint(ctx.p), interval=globs.status_check_interval,
+                               **data)
+
+
+@app.route('/_background_status_summary')
+def background_status_summary():
+    """
+    Get the numbers of the samples by status and the recent status transitions, for the progress bars
+    that do not need the status rows
+    """
+    summary = status_summary(current_context().p, recent=request.args.get('recent', default=STATUS_RECENT_CHANGES,
+                                                                          type=int))
+    return conditional_jsonify(interval=globs.status_check_interval, **summary)
+
+
+@app.route('/_background_dashboard')
+@token_required
+def background_dashboard():
+    """
+    Get the numbers of the samples by status for every project and subproject in the config
+    """
+    globs.cc = globs.cc or parse_config_file()
+    paths = [p for p in globs.cc.list_projects() if os.path.exists(p)]
+    return conditional_jsonify(**DASHBOARD.get(paths, refresh=bool(request.args.get('refresh'))))
+
+
+@app.route('/_background_status_history')
+def background_status_history():
+    """
+    Get the throughput time series of the selected project samples: the numbers of the started, completed
+    and failed samples, the completion and failure rates and the mean queue wait in each time bucket
+    """
+    ctx = current_context()
+    hours = request.args.get('hours', default=STATUS_HISTORY_WINDOW / 3600.0, type=float)
+    bucket = request.args.get('bucket', default=STATUS_HISTORY_BUCKET, type=int)
+    try:
+        data = globs.status_history.time_series(ctx.p.metadata.results_subdir, samples=set(ctx.p.sample_names),
+                                                since=time.time() - hours * 3600, bucket=bucket)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(**data)
+
+
+@app.route('/_background_eta')
+def background_eta():
+    """
+    Get the estimated time left until the waiting and running samples of the selected project complete
+    """
+    ctx = current_context()
+    return jsonify(**get_estimator(ctx.p).estimate(ctx.p))
+
+
+@app.route('/_stream_status')
+def stream_status():
+    """
+    Stream the sample status transitions as Server-Sent Events.
+
+    The stream is closed after a while, the browser reconnects automatically and resumes from the last event ID
+    """
+    ctx = current_context()
+    idx = get_flag_index(ctx.p)
+    samples = set(ctx.p.sample_names)
+    try:
+        version = int(request.headers.get("Last-Event-ID"))
+    except (TypeError, ValueError):
+        version = idx.version
+
+    def _events(version):
+        if version > idx.version:
+            # the index was recreated in the meantime, so the client needs to re-read all the flags
+            version = idx.version
+            yield "id: {}\nevent: reset\ndata: {{}}\n\n".format(version)
+        deadline = time.time() + STATUS_STREAM_DURATION
+        while time.time() < deadline:
+            version, changes = idx.changes_since(version, timeout=STATUS_STREAM_HEARTBEAT)
+            if changes is None:
+                yield "id: {}\nevent: reset\ndata: {{}}\n\n".format(version)
+                continue
+            changes = [c for c in changes if c["sample"] in samples]
+            if not changes:
+                yield ": heartbeat\n\n"
+                continue
+            for c in changes:
+                c["row_class"], c["label"] = status_appearance(c["new"])
+            yield "id: {}\ndata: {}\n\n".format(version, json.dumps(changes))
+
+    return Response(_events(version), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route('/_background_result')
 def background_result():
-    page = compile_results_content(globs.log_path, globs.act)
-    return jsonify(result=textile(page))
+    from textile import textile
+    ctx = current_context()
+    page = compile_results_content(ctx.log_path, ctx.act)
+    return conditional_jsonify(result=textile(page))
+
+
+@app.route('/_background_log_tail')
+def background_log_tail():
+    log_path = current_context().log_path
+    offset = request.args.get('offset', default=0, type=int)
+    tail = read_log_tail(log_path, offset=offset, window=globs.log_tail_window or LOG_TAIL_WINDOW)
+    if tail is None:
+        return jsonify(content="<b>Cannot find the log file: '{}'</b>".format(log_path), offset=offset,
+                       skipped=0, reset=True, missing=True)
+    return conditional_jsonify(missing=False, **tail)
+
+
+@app.route('/metrics')
+@token_required
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/_profile')
+@token_required
+def profile():
+    """
+    Sample the stacks of all the threads for a number of seconds. Returns an SVG flame graph,
+    collapsed stacks ('format=collapsed') or numbers of samples by package ('format=summary')
+    """
+    seconds = min(request.args.get('seconds', default=PROFILE_DEFAULT_SECONDS, type=float), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get('interval', default=PROFILE_SAMPLE_INTERVAL, type=float),
+                   PROFILE_MIN_SAMPLE_INTERVAL)
+    try:
+        stacks = sample_stacks(seconds, interval)
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 409
+    fmt = request.args.get('format', default="svg", type=str)
+    if fmt == "collapsed":
+        return Response(collapsed_stacks(stacks), mimetype="text/plain")
+    if fmt == "summary":
+        return jsonify(seconds=seconds, interval=interval, samples=package_summary(stacks))
+    return Response(flamegraph_svg(stacks), mimetype="image/svg+xml")
+
+
+@app.route('/_profile_request')
+@token_required
+def profile_request():
+    """
+    Select the endpoint whose next request is run under cProfile ('endpoint=<name>'),
+    or get the statistics of the last profiled request
+    """
+    endpoint = request.args.get('endpoint', type=str)
+    if endpoint is None:
+        if REQUEST_PROFILER.result is None:
+            return jsonify(error="No request was profiled yet"), 404
+        return Response(REQUEST_PROFILER.result, mimetype="text/plain")
+    if endpoint not in app.view_functions:
+        return jsonify(error="Endpoint '{}' not found".format(endpoint)), 404
+    REQUEST_PROFILER.arm(endpoint)
+    return jsonify(armed=endpoint)
 
 
 @app.route('/favicon.ico')
@@ -430,24 +876,70 @@ def favicon():
                                'caravel.ico', mimetype='image/vnd.microsoft.icon')
 
 
-def main():
-    ensure_version()
-    parser = CaravelParser()
-    args = parser.parse_args()
-    app.config["port"] = args.port
-    app.config["project_configs"] = args.config
-    app.config["DEBUG"] = args.debug
-    app.config["demo"] = args.demo
+def configure_app(config=None, port=DEFAULT_PORT, debug=False, demo=False, job_workers=JOB_WORKERS, workers=None,
+                  state_store=None, status_history=None):
+    """
+    Set up the application and the global state before it is served, or used via the test client
+
+    :param str config: path to the caravel config file
+    :param int port: the port the application is served on
+    :param bool debug: whether to run in the debug mode, with no token required
+    :param bool demo: whether to use the demo data
+    :param int job_workers: max number of the looper actions run at the same time
+    :param int workers: number of the worker processes the application is served by
+    :param str state_store: path to the file the session state is shared in by the workers
+    :param str status_history: path to the file the sample status transitions are recorded in
+    :return flask.Flask: the application
+    """
+    app.config["port"] = port
+    app.config["project_configs"] = config
+    app.config["DEBUG"] = debug
+    app.config["demo"] = demo
     app.config['SECRET_KEY'] = 'thisisthesecretkey'
     app.config['login'] = getpass.getuser()
+    app.config["workers"] = workers
+    # the workers do not share the config object, so its changes are written right away
+    app.config["config_write_delay"] = None if workers else CONFIG_WRITE_DELAY
     globs.init_globals()
+    store = None
+    if workers:
+        store = StateStore(state_store or os.path.join(tempfile.gettempdir(), STATE_STORE_FILENAME.format(port=port)))
+        app.logger.info("Using the state store: {}".format(store.path))
+    init_contexts(store=store)
+    globs.jobs = JobManager(app, max_workers=job_workers, store=store)
+    if globs.status_history is not None:
+        remove_change_listener(globs.status_history.record)
+    globs.status_history = StatusHistory(status_history or STATUS_HISTORY_PATH)
+    add_change_listener(globs.status_history.record)
+    if debug:
+        globs.logging_lvl = logging.DEBUG
+    app.logger.setLevel(globs.logging_lvl or logging.INFO)
+    return app
+
+
+def main():
+    parser = CaravelParser()
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        return
+    ensure_version()
+    configure_app(config=args.config, port=args.port, debug=args.debug, demo=args.demo, job_workers=args.job_workers,
+                  workers=args.workers, state_store=args.state_store, status_history=args.status_history)
     if app.config["DEBUG"]:
         warnings.warn("You have entered the debug mode. The server-client connection is not secure!")
-        globs.logging_lvl = logging.DEBUG
     else:
         generate_token(token=parse_token_file())
-    app.logger.setLevel(globs.logging_lvl or logging.INFO)
     app.logger.info("Using python {}".format(python_version()))
+    if args.workers:
+        # build the looper parser before the workers are forked, so they all share it
+        get_looper_parser()
+        serve(app, port=args.port, workers=args.workers, on_exit=partial(_stop_services, wait=True))
+        return
+    # import looper and build its parser in the background, so the first project page does not wait for it
+    warm_up = threading.Thread(target=get_looper_parser, name="warm-up")
+    warm_up.daemon = True
+    warm_up.start()
     app.run(port=args.port, host='0.0.0.0')
 
 
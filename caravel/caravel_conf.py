@@ -1,34 +1,74 @@
+import atexit
 import datetime
 import glob
+import logging
+import multiprocessing
+import stat
+import tempfile
+import threading
 from abc import ABC
 from collections import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from flask import current_app
-from looper import Project
-from peppy.exceptions import MissingSubprojectError
+from ubiquerg import create_lock, remove_lock
 from yacman import YacAttMap
 
 from .const import *
 from .exceptions import *
+from .metrics import timed
+from .project_cache import get_project
 
 
-# import logging
-# _LOGGER = logging.getLogger(__name__)
+_LOGGER = logging.getLogger(__name__)
+
+
+# delayed writers of the config files, by file path
+_DELAYED_WRITERS = dict()
+_DELAYED_WRITERS_LOCK = threading.Lock()
+
+
+def _flush_delayed_writers():
+    """
+    Write the pending changes of all the configs, at exit
+    """
+    with _DELAYED_WRITERS_LOCK:
+        writers = list(_DELAYED_WRITERS.values())
+    for writer in writers:
+        try:
+            writer.flush()
+        except Exception as e:
+            _LOGGER.warning("Could not write the config file '{}': {}".format(writer.cfg._file_path, e))
+
+
+atexit.register(_flush_delayed_writers)
 
 
 class CaravelConf(YacAttMap, ABC):
     """ Object used to interact with the caravel configuration file """
-    def __init__(self, filepath=None, entries=None, writable=False, wait_max=10):
+    def __init__(self, filepath=None, entries=None, writable=False, wait_max=10, write_delay=None):
         """
         Create the config instance by with a filepath or key-value pairs.
 
         :param str | Iterable[(str, object)] | Mapping[str, object] entries:
             config filepath or collection of key-value pairs
+        :param float write_delay: number of seconds the writes of the changes made in the object context are delayed
+            and coalesced for. If not provided, the file is locked and written every time the context is exited
         :raise refgenconf.MissingConfigDataError: if a required configuration
             item is missing
         :raise ValueError: if entries is given as a string and is not a file
         """
+        if write_delay is not None and filepath is not None:
+            # the changes pending in the config object this one replaces are written before the file is read
+            with _DELAYED_WRITERS_LOCK:
+                previous = _DELAYED_WRITERS.pop(os.path.abspath(filepath), None)
+            if previous is not None:
+                previous.flush()
         super(CaravelConf, self).__init__(filepath=filepath, entries=entries, writable=writable, wait_max=wait_max)
+        if write_delay is not None and self._file_path is not None:
+            with _DELAYED_WRITERS_LOCK:
+                _DELAYED_WRITERS[os.path.abspath(self._file_path)] = _DelayedWriter(self, write_delay, wait_max)
         # config_path = entries if isinstance(entries, str) else ""
         projects = self.setdefault(CFG_PROJECTS_KEY, dict())
         if not isinstance(projects, dict):
@@ -71,6 +111,31 @@ class CaravelConf(YacAttMap, ABC):
 
     __nonzero__ = __bool__
 
+    def __enter__(self):
+        writer = _delayed_writer(self)
+        if writer is None:
+            return super(CaravelConf, self).__enter__()
+        writer.lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        writer = _delayed_writer(self)
+        if writer is None:
+            return super(CaravelConf, self).__exit__(exc_type, exc_value, traceback)
+        try:
+            writer.schedule()
+        finally:
+            writer.lock.release()
+
+    def flush(self):
+        """
+        Write the pending changes to the config file right away. No-op if the writes are not delayed
+        """
+        writer = _delayed_writer(self)
+        if writer is not None:
+            writer.flush()
+
+    @timed
     def populate_project_metadata(self, attr_func=PROJECT_MDATA_FUN, paths=None, sp=None, clear=False):
         """
         Populate project metadata attributes for every entry in CaravelConf.projects.
@@ -83,6 +148,7 @@ class CaravelConf(YacAttMap, ABC):
         :param bool clear: whether specified project/subproject metadata should be removed
         :return: CaravelConf: object with populated project attributes
         """
+        from peppy.exceptions import MissingSubprojectError
 
         def _update_project_attrs(af_mapping, proj, subproj=None):
             """
@@ -120,7 +186,7 @@ class CaravelConf(YacAttMap, ABC):
             if clear:
                 self.update_projects(path=path, clear=True)
                 continue
-            p = Project(path)
+            p = get_project(path)
             _update_project_attrs(af_mapping=attr_func, proj=p)
             try:
                 sp = sp if sp is not None else p.subprojects.keys()
@@ -129,14 +195,32 @@ class CaravelConf(YacAttMap, ABC):
             else:
                 for i in sp:
                     try:
-                        p.activate_subproject(subproject=i)
-                        _update_project_attrs(af_mapping=attr_func, proj=p, subproj=i)
+                        _update_project_attrs(af_mapping=attr_func, proj=get_project(path, i), subproj=i)
                     except MissingSubprojectError:
                         current_app.logger.warning("Nonexistent project:subproject combination '{}:{}'. "
                                                    "Skipping".format(path, i))
             sp = sp_choice
         return self
 
+    def merge_project_metadata(self, metadata):
+        """
+        Merge the metadata collected with collect_project_metadata into the object
+
+        :param Mapping[str, list[(str, dict, list[str])]] metadata: subproject name, attributes and failed attributes
+            names for each project path
+        :return: CaravelConf: object with populated project attributes
+        """
+        for path, entries in metadata.items():
+            for subproj, attrs, failed in entries:
+                if attrs is None:
+                    current_app.logger.warning("Nonexistent project:subproject combination '{}:{}'. "
+                                               "Skipping".format(path, subproj))
+                    continue
+                for a in failed:
+                    current_app.logger.warning("Could not update '{}' attr for '{}'".format(a, path))
+                self.update_projects(path=path, sp=subproj, data=attrs)
+        return self
+
     def project_date(self, paths, sp=None):
         """
         Add current date and time to the selected project/subproject section of the CaravelConf object
@@ -232,6 +316,178 @@ class CaravelConf(YacAttMap, ABC):
         return [project for project in self.list_projects() if not os.path.exists(project)]
 
 
+def collect_project_metadata(paths, sp=None, workers=None):
+    """
+    Compute the default metadata attributes (PROJECT_MDATA_FUN) of the projects and their subprojects
+    in a pool of processes. The results are meant to be merged with CaravelConf.merge_project_metadata,
+    so the config does not need to be locked while they are computed.
+
+    :param Iterable[str] paths: paths to the project config files
+    :param list[str] | str sp: names of the subprojects to compute the data for, all if not provided
+    :param int workers: number of processes to use
+    :return dict[str, list[(str, dict, list[str])]]: subproject name, attributes and failed attributes names
+        for each project path
+    """
+    paths = [p for p in paths if os.path.exists(p)]
+    sp = [sp] if isinstance(sp, str) else sp
+    executor = _metadata_executor(workers)
+    try:
+        return dict(zip(paths, executor.map(_collect_single_project_metadata, paths, [sp] * len(paths))))
+    except BrokenProcessPool:
+        # a worker process died, a new pool is created next time
+        _reset_metadata_executor(executor)
+        raise
+
+
+_metadata_pool = None
+_metadata_pool_lock = threading.Lock()
+
+
+def _metadata_executor(workers):
+    """
+    Get the process pool the project metadata is collected in. The pool is created on the first use and reused.
+    Its processes are spawned rather than forked, since the server process runs multiple threads
+
+    :param int workers: number of processes
+    :return concurrent.futures.ProcessPoolExecutor: the pool
+    """
+    global _metadata_pool
+    with _metadata_pool_lock:
+        if _metadata_pool is not None and _metadata_pool[:2] != (os.getpid(), workers):
+            if _metadata_pool[0] == os.getpid():
+                _metadata_pool[2].shutdown(wait=False)
+            _metadata_pool = None
+        if _metadata_pool is None:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _metadata_pool = (os.getpid(), workers, executor)
+        return _metadata_pool[2]
+
+
+def _reset_metadata_executor(executor):
+    """
+    Forget the broken metadata process pool
+
+    :param concurrent.futures.ProcessPoolExecutor executor: the broken pool
+    """
+    global _metadata_pool
+    with _metadata_pool_lock:
+        if _metadata_pool is not None and _metadata_pool[2] is executor:
+            _metadata_pool = None
+    executor.shutdown(wait=False)
+
+
+def _collect_single_project_metadata(path, sp=None):
+    """
+    Compute the default metadata attributes of the project and its subprojects. Run in the worker processes
+
+    :param str path: path to the project config file
+    :param list[str] sp: names of the subprojects to compute the data for, all if not provided
+    :return list[(str, dict, list[str])]: subproject name (None for the project itself), attributes and
+        failed attributes names
+    """
+    from peppy.exceptions import MissingSubprojectError
+
+    def _eval_attrs(proj):
+        attrs, failed = dict(), list()
+        for a, f in PROJECT_MDATA_FUN.items():
+            try:
+                attrs[a] = f(proj)
+            except Exception:
+                attrs[a] = None
+                failed.append(a)
+        return attrs, failed
+
+    p = get_project(path)
+    results = [(None, ) + _eval_attrs(p)]
+    try:
+        sp = sp if sp is not None else list(p.subprojects.keys())
+    except AttributeError:
+        sp = []
+    for i in sp:
+        try:
+            results.append((i, ) + _eval_attrs(get_project(path, i)))
+        except MissingSubprojectError:
+            results.append((i, None, []))
+    return results
+
+
+def _delayed_writer(cfg):
+    """
+    Get the delayed writer of the config
+
+    :param CaravelConf cfg: the config
+    :return _DelayedWriter | None: the writer, None if the writes of the config are not delayed
+    """
+    if cfg._file_path is None:
+        return None
+    writer = _DELAYED_WRITERS.get(os.path.abspath(cfg._file_path))
+    return writer if writer is not None and writer.cfg is cfg else None
+
+
+class _DelayedWriter(object):
+    """
+    Coalesces the config writes: the first change schedules the write, the following ones are included in it.
+    The file is written atomically, via a temporary file and rename, holding the yacman file lock
+    """
+    def __init__(self, cfg, delay, wait_max=10):
+        """
+        :param CaravelConf cfg: the config to write
+        :param float delay: number of seconds to wait before writing the changes
+        :param int wait_max: max number of seconds to wait for the file lock
+        """
+        self.cfg = cfg
+        self.delay = delay
+        self.wait_max = wait_max
+        self.lock = threading.RLock()
+        self._timer = None
+        self._dirty = False
+
+    def schedule(self):
+        """
+        Mark the config as changed and schedule the write, unless one is already pending
+        """
+        with self.lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write the config file if it was changed since the last write
+        """
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            path = self.cfg._file_path
+            # the same lock file as the yacman writes, so the other processes do not write the file at the same time
+            create_lock(path, self.wait_max)
+            try:
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp", suffix=".yaml")
+                try:
+                    # mkstemp creates the file readable by the owner only, keep the mode of the config instead
+                    try:
+                        mode = stat.S_IMODE(os.stat(path).st_mode)
+                    except OSError:
+                        umask = os.umask(0)
+                        os.umask(umask)
+                        mode = 0o666 & ~umask
+                    os.chmod(tmp, mode)
+                    with os.fdopen(fd, "w") as f:
+                        f.write(self.cfg.to_yaml())
+                    os.rename(tmp, path)
+                except Exception:
+                    os.remove(tmp)
+                    raise
+            finally:
+                remove_lock(path)
+            self._dirty = False
+
+
 def check_insert_data(obj, datatype, name):
     """ Checks validity of an object """
     if obj is None:
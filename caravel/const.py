@@ -1,8 +1,7 @@
 """ Package constants """
 import os
-from divvy.const import COMPUTE_SETTINGS_VARNAME
-from looper import __version__ as LOOPER_VERSION, Sample as LooperSample
-from peppy import __version__ as PEPPY_VERSION
+from importlib import import_module
+from importlib.util import find_spec
 from ._version import __version__ as CARAVEL_VERSION
 from ubiquerg import filesize_to_str
 from warnings import warn
@@ -36,22 +35,46 @@ def get_req_version(module=None):
         return None
 
 
+def installed_version(module):
+    """
+    Get the version of the installed package without importing it, by reading its _version.py file.
+    If the file cannot be read, the package is imported
+
+    :param str module: name of the package
+    :return str: the package version
+    """
+    try:
+        version_file = os.path.join(find_spec(module).submodule_search_locations[0], "_version.py")
+        with open(version_file) as vf:
+            for l in vf:
+                if l.startswith("__version__"):
+                    return l.split("=")[1].strip().strip("\"'")
+    except (AttributeError, TypeError, IndexError, IOError):
+        pass
+    return import_module(module).__version__
+
+
 def input_sizes(p):
     """
     Safely determine all the input file sizes for a project. If any exception raises, return "NA".
 
+    The file sizes are read from the persistent cache, only the files that were not checked recently
+    are stat-ed, in parallel.
+
     :param looper.Project p: project to determine input file sizes for
     :return str: sum input file sizes
     """
-    cumulative_file_size = 0
+    from .file_sizes import get_file_size_cache, sample_input_files
     try:
+        files_by_sample_pipeline = []
         for s in p.samples:
-            s = LooperSample(s)
             for proto in [s.protocol] if isinstance(s.protocol, str) else s.protocol:
                 for piface in p.get_interfaces(proto):
-                    s.set_pipeline_attributes(piface, piface.fetch_pipelines(proto))
-                    cumulative_file_size += s.input_file_size * 1024 ** 3
-        return filesize_to_str(cumulative_file_size)
+                    files_by_sample_pipeline.append(sample_input_files(s, piface, piface.fetch_pipelines(proto)))
+        cache = get_file_size_cache()
+        sizes = cache.sizes(f for files in files_by_sample_pipeline for f in files)
+        cache.save()
+        return filesize_to_str(sum(sizes[f] for files in files_by_sample_pipeline for f in files))
     except Exception as e:
         warn("Could not determine file size for project: '{}'. Got: '{}'".format(p.name, e.__class__.__name__))
         return "NA"
@@ -65,28 +88,130 @@ CONFIG_TOKEN_KEY = "token"
 TOKEN_FILE_NAME = ".caravel_token"
 EXAMPLE_FILENAME = "caravel_demo.yaml"
 TOKEN_LEN = 15
+STARTUP_PROFILE_TOP_N = 15  # number of the slowest packages reported with --profile-startup
+# the packages whose import times are reported with --profile-startup, apart from the entry point imports.
+# These are imported on the first use
+DEFERRED_IMPORTS = ["looper", "peppy", "pandas", "divvy", "textile", "looper.html_reports"]
 SET_ELSEWHERE = [["--force-yes"], ["--sp"], ["--env"], ["--help"], ["--version"], ["--selector-attribute"],
                  ["--selector-exclude"], ["--selector-include"], ['--resources'], ['--compute-package'], ['']]
 LOG_FILENAME = "caravel.log"
-REQUIRED_LOOPER_VERSION = get_req_version("loopercli")["loopercli"]
-REQUIRED_PEPPY_VERSION = get_req_version("peppy")["peppy"]
-REQUIRED_V_BY_NAME = {"loopercli": REQUIRED_LOOPER_VERSION, "peppy": REQUIRED_PEPPY_VERSION}
+LOG_TAIL_WINDOW = 1024 ** 2  # max number of log bytes sent to the browser at once
+LOOPER_VERSION = installed_version("looper")
+PEPPY_VERSION = installed_version("peppy")
+# packages which versions are checked against the requirements file on launch
+REQUIRED_PACKAGES = ["loopercli", "peppy"]
 V_BY_NAME = {"loopercli": LOOPER_VERSION, "peppy": PEPPY_VERSION, "caravel": CARAVEL_VERSION}
 DEFAULT_TERMINAL_WIDTH = 80
+NAVBAR_LINKS_CACHE_SIZE = 50
+OPTIONS_CACHE_SIZE = 100
+SUMMARY_MANIFEST_FILENAME = "summary_manifest.json"
+# names of the per-sample results files collected in the project summaries
+SAMPLE_RESULTS_FILENAMES = {"stats": "stats.tsv", "objs": "objects.tsv"}
 SUMMARY_NAVBAR_PLACEHOLDER = "<li class='nav-item'><a class='nav-link disabled'>No summary yet</a></li>"
 TEMPLATES_DIRNAME = "jinja_templates"
 TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), TEMPLATES_DIRNAME)
 DEMO_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), EXAMPLE_FILENAME)
 COMMAND_KEY = "execute"
 POLL_INTERVAL = 3  # in seconds
+SLOW_REQUEST_THRESHOLD = 2  # in seconds, the requests handled for longer are logged
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+PROFILE_DEFAULT_SECONDS = 5
+PROFILE_MAX_SECONDS = 60
+PROFILE_SAMPLE_INTERVAL = 0.01  # in seconds
+PROFILE_MIN_SAMPLE_INTERVAL = 0.001  # in seconds
+# the packages the profiler samples are attributed to and the flame graph colors
+PROFILE_PACKAGES = ["caravel", "looper", "peppy"]
+PROFILE_PACKAGE_COLORS = {"caravel": "#e8743b", "looper": "#5a9bd4", "peppy": "#7ac36a", "other": "#c7c7c7"}
+PROFILE_SVG_WIDTH = 1200  # in pixels
+PROFILE_SVG_FRAME_HEIGHT = 16  # in pixels
+PROFILE_SVG_MIN_WIDTH = 0.5  # in pixels, the narrower frames are not drawn
+PROFILE_SVG_CHAR_WIDTH = 7  # in pixels
+PROFILE_STATS_SORT = "cumulative"
+PROFILE_STATS_LINES = 50
+STATIC_MAX_AGE = 365 * 24 * 3600  # in seconds, the fingerprinted static files are cached by the browsers for that long
+STATIC_HASH_LEN = 12
+FLAG_FILE_EXT = ".flag"
+FLAG_SWEEP_INTERVAL = 10  # in seconds
+FLAG_INDEX_CACHE_SIZE = 10  # max number of results folders watched at once
+RESULTS_SCAN_WORKERS = 16  # number of threads scanning the sample results folders
+RESULTS_SCAN_CHUNK = 256  # number of the sample folders scanned by a thread at once
+FLAG_CHANGES_MAX = 10000  # max number of status transitions kept for the streaming clients
+STATUS_STREAM_HEARTBEAT = 15  # in seconds
+STATUS_STREAM_DURATION = 300  # in seconds, the clients reconnect afterwards
+STATUS_TABLE_REFRESH = 60  # in seconds, the status table of a project with running samples is rebuilt that often
+STATUS_PAGE_SIZE = 100  # default number of the status table rows sent at once
+STATUS_PAGE_SIZE_MAX = 1000  # max number of the status table rows sent at once
+STATUS_SORT_KEYS = ["index", "name", "status"]
+STATUS_ROWS_CACHE_SIZE = 10  # max number of projects the sample statuses are cached for
+STATUS_VIEWS_MAX = 20  # max number of sorted and filtered status row lists cached per project
+STATUS_RECENT_CHANGES = 20  # default number of the recent status transitions in the status summary
+STATUS_ROW_HEIGHT = 33  # in pixels, the status table renders only the visible rows of this fixed height
+PIPELINE_LOG_SUFFIX = "_log.md"
+DASHBOARD_TTL = 30  # in seconds, the sample status counts of all the projects are reused for that long
+DASHBOARD_WORKERS = 8  # number of threads computing the sample status counts of the projects
+STATUS_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".caravel_status_history.sqlite")
+STATUS_HISTORY_TTL = 90 * 24 * 3600  # in seconds, the older status transitions are removed
+STATUS_HISTORY_FLUSH_INTERVAL = 5  # in seconds, the status transitions are inserted in batches that often
+STATUS_HISTORY_PRUNE_INTERVAL = 3600  # in seconds, the expired status transitions are removed that often
+STATUS_HISTORY_WINDOW = 24 * 3600  # in seconds, default time span of the throughput time series
+STATUS_HISTORY_BUCKET = 3600  # in seconds, default time bucket of the throughput time series
+STATUS_HISTORY_MIN_BUCKET = 60  # in seconds
+STATUS_HISTORY_MAX_BUCKETS = 1000
+STATUS_HISTORY_MAX_WAIT = 7 * 24 * 3600  # in seconds, the longer queue waits are not reported
+STATUS_HISTORY_DEDUP_WINDOW = 60  # in seconds, the same transitions of a sample recorded within are counted once
+PROFILE_FILE_SUFFIX = "_profile.tsv"  # pypiper per-sample profile file, prefixed with the pipeline name
+ETA_REFRESH = 30  # in seconds, the completion time estimate is requested by the page and its runtimes read that often
+ETA_READ_BUDGET = 500  # max number of the completed samples which runtimes are read per completion time estimate
+ETA_ESTIMATORS_MAX = 10  # max number of results folders the runtimes are kept for
+RESOURCES_MANIFEST_FILENAME = ".caravel_resources.json"  # in the results folder
+RESOURCES_SCANS_MAX = 16  # max number of sample sets the scan times are kept for, per results folder
+RESOURCES_TTL = 60  # in seconds, the sample folders are scanned for the resource usage at most that often
+RESOURCES_DEFAULT_CORES = 1  # used for the samples which stats do not report the number of cores
+RESOURCES_OUTLIER_THRESHOLD = 3.5  # robust z-score of the sample wall time or peak memory use
+RESOURCES_MIN_GROUP_SIZE = 5  # the outliers are not looked for in the smaller pipeline and protocol groups
+RESOURCES_OUTLIERS_MAX = 100  # max number of the outlier samples listed
+RESOURCES_TABLES_MAX = 10  # max number of results folders the resource usage tables are kept in memory for
+# mapping of flag names and the corresponding status table row classes and labels
+STATUS_APPEARANCE_BY_FLAG = {"completed": ("table-success", "Completed"),
+                             "running": ("table-primary", "Running"),
+                             "failed": ("table-danger", "Failed"),
+                             "partial": ("table-warning", "Partial"),
+                             "waiting": ("table-info", "Waiting")}
 MISSING_SAMPLE_DATA_TXT = "<code>looper run</code> was called, but not all the samples were correctly processed. " \
                             "</br>Possible reasons: <ul style='padding-left: 30px;'>"\
                             "<li>all jobs are still in a queue</li>" \
                             "<li>submission was not successful</li></ul>"
 REQ_CFG_VERSION = 0.2
+CONFIG_WRITE_DELAY = 2  # in seconds, the config changes are coalesced and written to the file after that long
+FILE_SIZES_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".caravel_file_sizes.json")
+FILE_SIZES_CACHE_TTL = 600  # in seconds, the cached file sizes are trusted without stat-ing the files for that long
+FILE_SIZES_CACHE_MAX_AGE = 30 * 24 * 3600  # in seconds, the cached file sizes not checked for that long are dropped
+FILE_SIZES_CACHE_SIZE = 100000  # max number of the cached file sizes, the least recently used ones are dropped
+STAT_WORKERS = 16  # number of threads stat-ing the input files
+METADATA_WORKERS = 1  # number of processes the project metadata is collected with, 1 for no parallelism
+PROJECT_CACHE_SIZE = 20  # max number of looper.Project objects kept in memory
+# project metadata keys pointing to the sample and subsample tables, old and new naming
+PROJECT_TABLE_KEYS = ["sample_annotation", "sample_subannotation", "sample_table", "subsample_table"]
+JOB_WORKERS = 4  # max number of looper actions run at the same time
+JOB_CANCEL_POLL_INTERVAL = 2  # in seconds, how often the cancellation requests from the other workers are checked
+STATE_STORE_FILENAME = "caravel_state_{port}.sqlite"  # in the temporary directory, unless selected with --state-store
+STATE_STORE_TIMEOUT = 10  # in seconds, max time to wait for the state store lock
+STATE_TTL = 7 * 24 * 3600  # in seconds, the state of the inactive sessions is removed afterwards
+SESSION_ID_LEN = 20
+SESSION_CONTEXTS_MAX = 100  # max number of the session contexts kept in memory
+# the selection state of a session kept in the state store when caravel is served by multiple worker processes
+SESSION_STATE_KEYS = ["selected_project", "selected_project_id", "current_subproj", "act", "dests", "log_path",
+                      "run", "summary_requested"]
+WORKER_TIMEOUT = 300  # in seconds, the worker processes handling a request for longer are restarted
+JOB_ID_LEN = 12
+JOBS_HISTORY_MAX = 100  # max number of finished jobs remembered
 # this preferences/types can be set in the config file under "preferences" key
 PREFERENCES_NAMES_TYPES = {"status_check_interval": int,
-                           "compute_package": str}
+                           "compute_package": str,
+                           "log_tail_window": int,
+                           "metadata_workers": int,
+                           "slow_request_threshold": int}
 # mapping of looper.Project metadata of interest and lambda expressions extracting them
 PROJECT_MDATA_FUN = {"name": lambda p: p.name,
                      "names_sp": lambda p: ", ".join(p.subprojects.keys()),
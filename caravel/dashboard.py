@@ -0,0 +1,148 @@
+""" Sample status counts of all the configured projects and subprojects, computed in parallel """
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .const import *
+from .flag_index import FlagIndex, find_flag_index, flag_names
+from .project_cache import files_fingerprint, source_files
+from .status_rows import count_statuses
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Dashboard(object):
+    """
+    The sample status counts of the projects and their subprojects, cached for a short time.
+
+    The counts of the projects are computed concurrently. Only the project name, results folder and sample names
+    are kept for each project and subproject, validated against the modification times of the project source files,
+    so the looper.Project objects are not created again until these files change. The flag indexes of the results
+    folders are kept as well, so each refresh scans again only the sample folders that changed
+    """
+    def __init__(self, ttl=DASHBOARD_TTL, workers=DASHBOARD_WORKERS):
+        """
+        Create the dashboard
+
+        :param int ttl: number of seconds the computed counts are reused for
+        :param int workers: number of threads computing the counts of the projects
+        """
+        self.ttl = ttl
+        self.workers = workers
+        self._descriptions = dict()
+        # indexes of the results folders that are not watched by a running flag index, kept between the refreshes
+        self._indexes = dict()
+        self._refreshes = 0
+        self._result = None
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+
+    def get(self, paths, refresh=False):
+        """
+        Get the sample status counts of the projects and their subprojects
+
+        :param Iterable[str] paths: paths to the project config files
+        :param bool refresh: whether the counts should be computed even if the cached ones did not expire
+        :return dict: the time the counts were computed at and the counts of each project and subproject
+        """
+        paths = tuple(str(os.path.expandvars(os.path.expanduser(p))) for p in paths)
+        with self._compute_lock:
+            with self._lock:
+                if not refresh and self._result is not None and self._result[0] == paths and \
+                        time.time() - self._result[1]["computed"] < self.ttl:
+                    return self._result[1]
+            self._refreshes += 1
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                projects = [e for entries in executor.map(self._project_statuses, paths) for e in entries]
+            result = {"computed": time.time(), "ttl": self.ttl, "projects": projects}
+            with self._lock:
+                self._result = (paths, result)
+                # forget the projects removed from the config
+                for key in [k for k in self._descriptions if k[0] not in paths]:
+                    del self._descriptions[key]
+                results_dirs = {d[2]["results_dir"] for d in self._descriptions.values()}
+                for results_dir in [d for d in self._indexes if d not in results_dirs]:
+                    del self._indexes[results_dir]
+            return result
+
+    def _project_statuses(self, path):
+        """
+        Compute the sample status counts of the project and its subprojects
+
+        :param str path: path to the project config file
+        :return list[dict]: the counts of the project and each subproject
+        """
+        try:
+            project = self.describe(path)
+        except Exception as e:
+            _LOGGER.warning("Project '{}' could not be loaded: {}".format(path, e))
+            return [{"path": path, "subproject": None, "name": None, "error": str(e)}]
+        entries = [self._statuses(path, None, project)]
+        for sp in project["subprojects"]:
+            try:
+                entries.append(self._statuses(path, sp, self.describe(path, sp)))
+            except Exception as e:
+                _LOGGER.warning("Subproject '{}' of '{}' could not be loaded: {}".format(sp, path, e))
+                entries.append({"path": path, "subproject": sp, "name": project["name"], "error": str(e)})
+        return entries
+
+    def describe(self, path, sp=None):
+        """
+        Get the name, results folder, sample names and subproject names of the project.
+        The description is cached until the project source files change, the looper.Project is not kept
+
+        :param str path: path to the project config file
+        :param str sp: name of the subproject to activate
+        :return dict: the project description
+        """
+        key = (path, sp)
+        with self._lock:
+            cached = self._descriptions.get(key)
+        if cached is not None and files_fingerprint(cached[0]) == cached[1]:
+            return cached[2]
+        # the Project is not taken from the project cache, so loading all the projects does not evict the ones in use
+        from looper import Project
+        p = Project(path, subproject=sp)
+        files = source_files(p)
+        try:
+            sp_names = list(p.subprojects.keys()) if sp is None else []
+        except AttributeError:
+            sp_names = []
+        description = {"name": p.name, "results_dir": p.metadata.results_subdir,
+                       "samples": list(p.sample_names), "subprojects": sp_names}
+        with self._lock:
+            self._descriptions[key] = (files, files_fingerprint(files), description)
+        return description
+
+    def _statuses(self, path, sp, project):
+        """
+        Count the samples of the project by status. The flag index of the results folder is used if it is running,
+        otherwise the index kept by the dashboard is swept, so only the sample folders that changed since
+        the previous refresh are scanned again
+
+        :param str path: path to the project config file
+        :param str sp: name of the subproject
+        :param dict project: the project description
+        :return dict: the numbers of the samples in total and by status
+        """
+        results_dir = project["results_dir"]
+        idx = find_flag_index(results_dir)
+        if idx is None:
+            with self._lock:
+                idx, swept = self._indexes.get(results_dir) or (None, self._refreshes)
+                if idx is None:
+                    idx = FlagIndex(results_dir, workers=max(1, RESULTS_SCAN_WORKERS // self.workers))
+                # the subprojects share the results folder, it is swept once per refresh
+                self._indexes[results_dir] = (idx, self._refreshes)
+            if swept != self._refreshes:
+                idx.sweep()
+        flags = idx.flags(project["samples"])
+        counts = count_statuses(flag_names(flags[s]) for s in project["samples"])
+        return {"path": path, "subproject": sp, "name": project["name"], "total": len(project["samples"]),
+                "counts": counts}
+
+
+DASHBOARD = Dashboard()
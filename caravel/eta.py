@@ -0,0 +1,220 @@
+""" Completion time estimates of the running projects, based on the per-sample runtimes reported by pypiper """
+
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict
+
+from .const import *
+from .flag_index import get_flag_index
+from .pipeline_profile import parse_duration, pipeline_name, profile_state, read_profile, read_stats
+from .status_rows import samples_with_status
+
+_LOGGER = logging.getLogger(__name__)
+
+_ESTIMATORS = OrderedDict()
+_ESTIMATORS_LOCK = threading.Lock()
+
+
+class RuntimeEstimator(object):
+    """
+    Keeps the runtimes of the completed samples of a results folder, grouped by pipeline and protocol,
+    and projects the completion time of the waiting and running ones.
+
+    The runtime of a sample is the sum of the command runtimes in its pypiper profile file, or the 'Time' reported
+    in its stats file. The profile files are read incrementally: only the rows appended since the previous read
+    are parsed. The runtimes of at most ETA_READ_BUDGET completed samples are read per estimate, so the first
+    estimates of a large project are based on a part of its samples
+    """
+    def __init__(self, results_dir):
+        """
+        :param str results_dir: path to the folder with the sample results folders
+        """
+        self.results_dir = results_dir
+        self._profiles = dict()
+        self._runtimes = dict()
+        self._finished = dict()
+        self._protocols = (None, dict())
+        self._estimate = None
+        self._lock = threading.Lock()
+
+    def estimate(self, p):
+        """
+        Estimate the time left until the waiting and running samples of the project complete
+
+        :param looper.Project p: the project
+        :return dict: the estimate in seconds (None if there is no runtime to base it on), the expected finish time,
+            the numbers of the samples in each state and the runtime distributions the estimate is based on
+        """
+        with self._lock:
+            now = time.time()
+            idx = get_flag_index(p)
+            # the estimate is reused until the sample statuses change, only the time left is updated
+            version = (idx.created, idx.version)
+            if self._estimate is not None and self._estimate[0] == version and self._estimate[3] is p and \
+                    (not self._estimate[2]["runtimes_pending"] or now - self._estimate[1] < ETA_REFRESH):
+                res = dict(self._estimate[2])
+                if res["finish"] is not None:
+                    res["eta"] = max(res["finish"] - now, 0.0)
+                return res
+            by_status = samples_with_status(p, ["Completed", "Running", "Waiting"])
+            completed = by_status["Completed"]
+            protocols = self._sample_protocols(p)
+            self._forget_rerun(set(completed))
+            pending = [s for s in completed if s not in self._finished]
+            ingest = pending[:ETA_READ_BUDGET]
+            flags = idx.flags(by_status["Running"] + by_status["Waiting"] + ingest)
+            for s in ingest:
+                pipeline = pipeline_name(flags[s])
+                key = (pipeline, protocols.get(s))
+                runtime = self._profile_runtime(s, pipeline, final=True)
+                if runtime is None:
+                    reported = read_stats(os.path.join(self.results_dir, s), pipeline, ["Time"]).get("Time")
+                    runtime = parse_duration(reported) if reported is not None else None
+                self._profiles.pop(s, None)
+                self._finished[s] = key if runtime is not None else None
+                if runtime is not None:
+                    self._runtimes.setdefault(key, dict())[s] = runtime
+            distributions = {k: (statistics.median(v.values()), statistics.mean(v.values()), len(v))
+                             for k, v in self._runtimes.items() if v}
+            remaining, expected_total, unknown = [], 0.0, 0
+            running = set(by_status["Running"])
+            for s in [s for s in self._profiles if s not in running]:
+                del self._profiles[s]
+            for s in by_status["Running"]:
+                pipeline = pipeline_name(flags[s])
+                # the profile is followed while the sample runs, so only its last rows are left when it completes
+                profile_runtime = self._profile_runtime(s, pipeline)
+                expected = _expected_runtime(distributions, pipeline, protocols.get(s))
+                if expected is None:
+                    unknown += 1
+                    continue
+                remaining.append(max(expected - _elapsed(flags[s], now, profile_runtime), 0.0))
+            for s in by_status["Waiting"]:
+                expected = _expected_runtime(distributions, pipeline_name(flags[s]), protocols.get(s))
+                if expected is None:
+                    unknown += 1
+                    continue
+                expected_total += expected
+            # the waiting samples are assumed to run as many at a time as are running now
+            slots = max(len(by_status["Running"]), 1)
+            eta = None
+            if remaining or expected_total:
+                eta = max(max(remaining or [0.0]), (sum(remaining) + expected_total) / slots)
+            elif not by_status["Running"] and not by_status["Waiting"]:
+                eta = 0.0
+            res = {"eta": eta, "finish": now + eta if eta is not None else None,
+                   "completed": len(completed), "running": len(by_status["Running"]),
+                   "waiting": len(by_status["Waiting"]), "unknown": unknown,
+                   "runtimes_pending": len(pending) - len(ingest),
+                   "runtimes": [{"pipeline": k[0], "protocol": k[1], "median": d[0], "mean": d[1], "n": d[2]}
+                                for k, d in sorted(distributions.items(), key=lambda i: str(i[0]))]}
+            self._estimate = (version, now, res, p)
+            return dict(res)
+
+    def _forget_rerun(self, completed):
+        """
+        Remove the runtimes of the samples that are no longer completed, e.g. were submitted again
+
+        :param set[str] completed: names of the completed samples
+        """
+        for s in [s for s in self._finished if s not in completed]:
+            key = self._finished.pop(s)
+            if key is not None:
+                self._runtimes.get(key, dict()).pop(s, None)
+
+    def _sample_protocols(self, p):
+        """
+        Get the protocols of the project samples, read once per Project object
+
+        :param looper.Project p: the project
+        :return dict[str, str]: protocol by sample name
+        """
+        if self._protocols[0] is not p:
+            protocols = dict()
+            for s in p.samples:
+                proto = getattr(s, "protocol", None)
+                protocols[s.name] = proto if proto is None or isinstance(proto, str) else ", ".join(proto)
+            self._protocols = (p, protocols)
+        return self._protocols[1]
+
+    def _profile_runtime(self, sample, pipeline, final=False):
+        """
+        Read the rows appended to the pypiper profile file of the sample since the previous read
+
+        :param str sample: name of the sample
+        :param str pipeline: name of the pipeline
+        :param bool final: whether the profile is complete, so its last line is read even if not terminated
+        :return float | None: the sum of the command runtimes so far, in seconds; None if there is no profile file
+        """
+        if pipeline is None:
+            return None
+        path = os.path.join(self.results_dir, sample, "{}{}".format(pipeline, PROFILE_FILE_SUFFIX))
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._profiles.pop(sample, None)
+            return None
+        state = self._profiles.get(sample)
+        if state is None or state["path"] != path or state["inode"] != st.st_ino or st.st_size < state["offset"]:
+            # the profile file was created again, e.g. by a rerun
+            state = self._profiles[sample] = profile_state(path, st.st_ino)
+        try:
+            read_profile(state, final=final)
+        except OSError:
+            return None
+        return state["runtime"]
+
+
+def _elapsed(flags, now, profile_runtime=None):
+    """
+    Get the time the sample has been running for: since the running flag was created, or the sum of
+    the command runtimes in the profile file if the flag cannot be stat-ed
+
+    :param list[str] flags: flag file paths of the sample
+    :param float now: the current time
+    :param float profile_runtime: the sum of the command runtimes in the profile file
+    :return float: number of seconds
+    """
+    try:
+        return max(now - os.stat(flags[0]).st_mtime, 0.0)
+    except (OSError, IndexError):
+        return profile_runtime or 0.0
+
+
+def _expected_runtime(distributions, pipeline, protocol):
+    """
+    Get the expected runtime of a sample: the median runtime of the completed samples run with the same pipeline
+    and protocol, the same pipeline, or any, whichever is available first
+
+    :param dict distributions: median, mean and number of the runtimes by pipeline and protocol
+    :param str pipeline: name of the pipeline
+    :param str protocol: the sample protocol
+    :return float | None: the expected runtime in seconds, None if there are no runtimes
+    """
+    if (pipeline, protocol) in distributions:
+        return distributions[(pipeline, protocol)][0]
+    for keys in [[k for k in distributions if k[0] == pipeline], list(distributions)]:
+        if keys:
+            # weighted by the numbers of the runtimes
+            return sum(distributions[k][0] * distributions[k][2] for k in keys) / sum(distributions[k][2] for k in keys)
+    return None
+
+
+def get_estimator(p):
+    """
+    Get the runtime estimator for the project results folder, create one if needed.
+    The number of the estimators is bounded, the least recently used ones are dropped
+
+    :param looper.Project p: the project
+    :return RuntimeEstimator: the estimator
+    """
+    results_dir = p.metadata.results_subdir
+    with _ESTIMATORS_LOCK:
+        estimator = _ESTIMATORS.pop(results_dir, None) or RuntimeEstimator(results_dir)
+        _ESTIMATORS[results_dir] = estimator
+        while len(_ESTIMATORS) > ETA_ESTIMATORS_MAX:
+            _ESTIMATORS.popitem(last=False)
+    return estimator
@@ -2,7 +2,7 @@
 
 import abc
 
-__all__ = ["CaravelError", "CaravelConfigError", "ConfigNotCompliantError"]
+__all__ = ["CaravelError", "CaravelConfigError", "ConfigNotCompliantError", "JobCancelledError"]
 
 DOC_URL = "http://caravel.databio.org/en/latest/configure-caravel"
 
@@ -31,3 +31,11 @@ class CaravelConfigError(CaravelError):
 class ConfigNotCompliantError(CaravelError):
     """ The format of the config file does not match required version/standards """
     pass
+
+
+class JobCancelledError(BaseException):
+    """
+    Raised by a running looper action when its job cancellation was requested.
+    Not an Exception subclass, so the generic exception handlers in the action code do not swallow it
+    """
+    pass
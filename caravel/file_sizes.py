@@ -0,0 +1,193 @@
+""" Disk-backed cache of the input file sizes """
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ubiquerg import create_lock, remove_lock
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class FileSizeCache(object):
+    """
+    Cache of the file sizes keyed on the file path, modification time and inode.
+
+    An entry checked more recently than the TTL is trusted without stat-ing the file, the other files are stat-ed
+    by a pool of threads and their entries are replaced if the modification time or inode changed. The cache is
+    persisted in a JSON file, so it survives the caravel restarts; it is bounded by the number of the entries
+    and their age, the least recently used ones are dropped first. The file is written only when the entries
+    changed, under a file lock and merged with the entries saved by the other processes in the meantime.
+    """
+    def __init__(self, path=FILE_SIZES_CACHE_PATH, ttl=FILE_SIZES_CACHE_TTL, max_age=FILE_SIZES_CACHE_MAX_AGE,
+                 max_size=FILE_SIZES_CACHE_SIZE, workers=STAT_WORKERS, wait_max=10):
+        """
+        Create the cache, read the entries persisted in the file if it exists
+
+        :param str path: path to the file the cache is persisted in
+        :param int ttl: number of seconds the cached size is trusted for without stat-ing the file
+        :param int max_age: number of seconds an entry that was not checked is kept for
+        :param int max_size: max number of the entries
+        :param int workers: number of threads used to stat the files
+        :param int wait_max: max number of seconds to wait for the file lock
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_size = max_size
+        self.workers = workers
+        self.wait_max = wait_max
+        self._entries = _read_entries(path)
+        self._dirty = False
+        self._lock = threading.Lock()
+        with self._lock:
+            self._evict(time.time())
+
+    def sizes(self, paths):
+        """
+        Get the sizes of the files. Only the files not checked within the TTL are stat-ed
+
+        :param Iterable[str] paths: paths to the files
+        :return dict[str, int]: file sizes in bytes, 0 for the missing files
+        """
+        now = time.time()
+        paths = set(paths)
+        with self._lock:
+            stale = [p for p in paths if p not in self._entries or now - self._entries[p][3] > self.ttl]
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                stats = list(executor.map(_stat, stale))
+            with self._lock:
+                for p, st in zip(stale, stats):
+                    key = [None, None] if st is None else [st.st_mtime, st.st_ino]
+                    entry = self._entries.get(p)
+                    if entry is None or entry[:2] != key:
+                        self._entries[p] = key + [0 if st is None else st.st_size, now]
+                    else:
+                        entry[3] = now
+                self._dirty = True
+        with self._lock:
+            for p in paths:
+                self._entries.move_to_end(p)
+            self._evict(now)
+            return {p: self._entries[p][2] for p in paths}
+
+    def save(self):
+        """
+        Persist the cache in the file, atomically. Nothing is written if the entries did not change
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+        try:
+            # the cache is shared by the caravel processes, so the entries they saved in the meantime are kept
+            create_lock(self.path, self.wait_max)
+            try:
+                saved = _read_entries(self.path)
+                with self._lock:
+                    for p, entry in saved.items():
+                        current = self._entries.get(p)
+                        if current is None or current[3] < entry[3]:
+                            self._entries[p] = entry
+                    self._entries = OrderedDict(sorted(self._entries.items(), key=lambda e: e[1][3]))
+                    self._evict(time.time())
+                    data = json.dumps(self._entries)
+                    self._dirty = False
+                dirname = os.path.dirname(self.path) or "."
+                fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp", suffix=".json")
+                with os.fdopen(fd, "w") as f:
+                    f.write(data)
+                os.rename(tmp, self.path)
+            finally:
+                remove_lock(self.path)
+        except (IOError, OSError, RuntimeError) as e:
+            _LOGGER.warning("File sizes cache could not be saved in '{}': {}".format(self.path, e))
+
+    def _evict(self, now):
+        """
+        Drop the least recently used entries over the size limit and the ones not checked for longer than max age.
+        Must be called with the lock held
+
+        :param float now: current time
+        """
+        while self._entries:
+            path, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and now - entry[3] <= self.max_age:
+                break
+            del self._entries[path]
+            self._dirty = True
+
+
+def _read_entries(path):
+    """
+    Read the entries persisted in the cache file, the least recently checked first
+
+    :param str path: path to the cache file
+    :return OrderedDict: the entries, empty if the file does not exist or cannot be read
+    """
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+        return OrderedDict(sorted(entries.items(), key=lambda e: e[1][3]))
+    except (IOError, ValueError, TypeError, IndexError, AttributeError):
+        _LOGGER.debug("File sizes cache could not be read: {}".format(path))
+        return OrderedDict()
+
+
+def _stat(path):
+    """
+    Stat the file
+
+    :param str path: path to the file
+    :return os.stat_result | None: the file stats, None if the file does not exist
+    """
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def sample_input_files(sample, piface, pipeline):
+    """
+    List the input files of the sample for the pipeline, the ones that looper counts in the input size.
+    Unlike looper.Sample.set_pipeline_attributes, this does not stat or open the files
+
+    :param peppy.Sample sample: the sample
+    :param looper.PipelineInterface piface: the pipeline interface defining the pipeline
+    :param str pipeline: the pipeline key
+    :return list[str]: paths to the input files
+    """
+    attrs = piface.get_attribute(pipeline, "all_input_files") or \
+        piface.get_attribute(pipeline, "required_input_files") or []
+    files = []
+    for a in [attrs] if isinstance(attrs, str) else attrs:
+        value = getattr(sample, a, None)
+        if not value:
+            continue
+        for v in [value] if isinstance(value, str) else value:
+            files.extend(str(v).split())
+    return files
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_file_size_cache():
+    """
+    Get the process-wide file sizes cache
+
+    :return FileSizeCache: the cache
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FileSizeCache()
+    return _cache
@@ -0,0 +1,436 @@
+""" Filesystem-event-driven index of the sample flag files and the per-sample results files """
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .const import *
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+_LOGGER = logging.getLogger(__name__)
+
+# inotify events that may change the set of flag files in a sample folder
+_SAMPLE_DIR_EVENTS = ("CREATE", "DELETE", "MOVED_FROM", "MOVED_TO")
+# inotify events that indicate a new sample folder in the results folder
+_RESULTS_DIR_EVENTS = ("CREATE", "MOVED_TO")
+
+# kinds of the per-sample results files by their names
+_KINDS_BY_FILENAME = {v: k for k, v in SAMPLE_RESULTS_FILENAMES.items()}
+
+# flag file paths and [size, modification time] of the per-sample results files by kind, see SAMPLE_RESULTS_FILENAMES
+SampleResults = namedtuple("SampleResults", ["flags", "files"])
+
+_INDEXES = OrderedDict()
+_INDEXES_LOCK = threading.Lock()
+# callables invoked with the results folder path and each status transition detected by any of the indexes
+_CHANGE_LISTENERS = []
+
+
+class FlagIndex(object):
+    """
+    In-memory index of the flag files and the stats and objects files found in the sample results folders.
+
+    The index is kept up to date by a background thread, which consumes inotify events where available
+    and periodically sweeps the sample folders with os.scandir, so reading the flags does not touch the filesystem.
+    The sample folders are scanned in a single pass each, by a pool of threads; the results folder is listed once
+    per scan, so the samples without a folder are not accessed at all.
+    """
+    def __init__(self, results_dir, sweep_interval=FLAG_SWEEP_INTERVAL, workers=RESULTS_SCAN_WORKERS):
+        """
+        Create the index for the selected results folder
+
+        :param str results_dir: path to the folder with the sample results folders
+        :param int sweep_interval: number of seconds between the consecutive sweeps of the sample folders
+        :param int workers: number of threads scanning the sample folders
+        """
+        self.results_dir = results_dir
+        self.sweep_interval = sweep_interval
+        self.workers = workers
+        self.version = 0
+        # the versions of the indexes created for the same folder are told apart by the creation time
+        self.created = time.time()
+        self._flags = dict()
+        self._files = dict()
+        self._dir_mtimes = dict()
+        self._changes = deque(maxlen=FLAG_CHANGES_MAX)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        self._watched = dict()
+        self._watched_samples = set()
+
+    def flags(self, samples):
+        """
+        Get the flag files for the selected samples. The samples that are not indexed yet are scanned right away
+
+        :param Iterable[str] samples: names of the samples to get the flags for
+        :return dict: a dictionary of sample names and the corresponding flag file paths
+        """
+        samples = self._index(samples)
+        with self._lock:
+            return {s: list(self._flags.get(s, [])) for s in samples}
+
+    def any_flags(self, samples):
+        """
+        Check whether any of the selected samples has a flag file
+
+        :param Iterable[str] samples: names of the samples to check
+        :return bool: whether any flag file was found
+        """
+        samples = self._index(samples)
+        with self._lock:
+            return any(self._flags.get(s) for s in samples)
+
+    def scan(self, samples):
+        """
+        Scan the folders of the selected samples right away and update the index.
+        Unlike the flags, the results files may change without the folder modification, so they are reported
+        only by a fresh scan
+
+        :param Iterable[str] samples: names of the samples to scan
+        :return dict[str, SampleResults]: the flag files and the results files fingerprints by sample name
+        """
+        return self._rescan_many(samples)
+
+    def _index(self, samples):
+        """
+        Scan the selected samples that are not indexed yet
+
+        :param Iterable[str] samples: names of the samples
+        :return list[str]: names of the samples
+        """
+        samples = list(samples)
+        with self._lock:
+            missing = [s for s in samples if s not in self._flags]
+        if missing:
+            self._rescan_many(missing)
+        return samples
+
+    def changes_since(self, version, timeout=None):
+        """
+        Get the status transitions recorded after the selected index version.
+        Blocks until there are any or the timeout passes.
+
+        :param int version: the last index version the caller knows about
+        :param float timeout: max number of seconds to wait for the transitions
+        :return (int, list[dict] | None): current index version and the transitions, each with 'sample', 'old' and
+            'new' flag names. None is returned in place of the transitions if the older ones were already discarded
+            and the caller needs to re-read all the flags
+        """
+        with self._lock:
+            if self.version <= version:
+                self._changed.wait(timeout)
+            if self.version <= version:
+                return self.version, []
+            if not self._changes or self._changes[0][0] > version + 1:
+                return self.version, None
+            return self.version, [c for v, c in self._changes if v > version]
+
+    def recent_changes(self, n, samples=None):
+        """
+        Get the most recent status transitions, without waiting for the new ones
+
+        :param int n: max number of the transitions to return
+        :param Container[str] samples: names of the samples to get the transitions for, all if not provided
+        :return list[dict]: the transitions, the most recent first, each with 'sample', 'old' and 'new' flag names
+            and the 'time' it was detected at
+        """
+        res = []
+        with self._lock:
+            for _, c in reversed(self._changes):
+                if len(res) >= n:
+                    break
+                if samples is None or c["sample"] in samples:
+                    res.append(dict(c))
+        return res
+
+    def sweep(self):
+        """
+        Rescan the indexed sample folders which modification time changed since the previous sweep
+        """
+        with self._lock:
+            samples = list(self._flags.keys())
+        self._rescan_many(samples, force=False)
+
+    def start(self):
+        """
+        Start the background thread that keeps the index up to date
+
+        :return FlagIndex: the started index
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="flag-index")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the background thread and release the inotify watches
+        """
+        self._stop.set()
+        if self._inotify is not None:
+            try:
+                self._inotify.close()
+            except OSError:
+                pass
+
+    def _rescan_many(self, samples, force=True):
+        """
+        Scan the sample folders with a pool of threads, each takes a chunk of the samples
+
+        :param Iterable[str] samples: names of the samples to scan
+        :param bool force: whether the folders should be scanned even if their modification time did not change
+        :return dict[str, SampleResults]: the flag files and the results files fingerprints by sample name
+        """
+        samples = list(samples)
+        existing = _list_dirs(self.results_dir)
+
+        def _scan_chunk(chunk):
+            return [(s, self._rescan(s, force=force, exists=existing is None or s in existing)) for s in chunk
+                    if not self._stop.is_set()]
+
+        chunks = [samples[i:i + RESULTS_SCAN_CHUNK] for i in range(0, len(samples), RESULTS_SCAN_CHUNK)]
+        if len(chunks) <= 1 or self.workers <= 1:
+            results = [_scan_chunk(c) for c in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(_scan_chunk, chunks))
+        return dict(r for chunk in results for r in chunk)
+
+    def _rescan(self, sample, force=True, exists=True):
+        """
+        Scan the sample folder for flag files and results files and update the index
+
+        :param str sample: name of the sample to scan
+        :param bool force: whether the folder should be scanned even if its modification time did not change
+        :param bool exists: whether the sample folder may exist, it is not accessed otherwise
+        :return SampleResults: the flag files and the results files fingerprints
+        """
+        sample_dir = os.path.join(self.results_dir, sample)
+        try:
+            mtime = os.stat(sample_dir).st_mtime if exists else None
+        except OSError:
+            mtime = None
+        if not force and mtime is not None and self._dir_mtimes.get(sample) == mtime:
+            with self._lock:
+                return SampleResults(list(self._flags.get(sample, [])), dict(self._files.get(sample, {})))
+        res = _scan_sample(sample_dir) if mtime is not None else SampleResults([], dict())
+        flags = res.flags
+        # coarse mtime resolution may hide the changes made in the same second, so do not trust the fresh ones
+        self._dir_mtimes[sample] = mtime if mtime is None or time.time() - mtime > 2 else None
+        change = None
+        with self._lock:
+            self._files[sample] = res.files
+            old = self._flags.get(sample)
+            if old != flags:
+                self._flags[sample] = list(flags)
+                if old is not None:
+                    self.version += 1
+                    change = {"sample": sample, "old": flag_names(old), "new": flag_names(flags), "time": time.time()}
+                    self._changes.append((self.version, change))
+                    self._changed.notify_all()
+        if change is not None:
+            for listener in _CHANGE_LISTENERS:
+                try:
+                    listener(self.results_dir, dict(change))
+                except Exception as e:
+                    _LOGGER.warning("Status transition listener failed: {}".format(e))
+        if mtime is not None and self._inotify is not None and sample not in self._watched_samples:
+            self._watch(sample)
+        return res
+
+    def _setup_inotify(self):
+        """
+        Initialize the inotify instance if the inotify_simple package is available and supported by the OS
+
+        :return bool: whether the inotify is used
+        """
+        if inotify_simple is None:
+            _LOGGER.debug("'inotify_simple' not installed, flag index uses periodic sweeps only")
+            return False
+        try:
+            self._inotify = inotify_simple.INotify()
+            mask = _mask(_RESULTS_DIR_EVENTS)
+            self._watched[self._inotify.add_watch(self.results_dir, mask)] = None
+        except OSError as e:
+            _LOGGER.debug("Could not watch '{}' with inotify ({}), "
+                          "flag index uses periodic sweeps only".format(self.results_dir, e))
+            self._inotify = None
+            return False
+        with self._lock:
+            samples = list(self._flags.keys())
+        for s in samples:
+            self._watch(s)
+        return True
+
+    def _watch(self, sample):
+        """
+        Add the inotify watch for the sample folder. Sweeps still cover the sample if the watch cannot be added
+
+        :param str sample: name of the sample to watch
+        """
+        try:
+            wd = self._inotify.add_watch(os.path.join(self.results_dir, sample), _mask(_SAMPLE_DIR_EVENTS))
+        except (OSError, ValueError) as e:
+            _LOGGER.debug("Could not watch the results folder of '{}': {}".format(sample, e))
+        else:
+            self._watched[wd] = sample
+            self._watched_samples.add(sample)
+
+    def _run(self):
+        """
+        The body of the background thread: rescan the samples pointed to by inotify events and sweep periodically
+        """
+        self.sweep()
+        last_sweep = time.time()
+        use_inotify = self._setup_inotify()
+        while not self._stop.is_set():
+            if use_inotify:
+                try:
+                    events = self._inotify.read(timeout=int(self.sweep_interval * 1000))
+                except (OSError, ValueError):
+                    # the inotify instance was closed
+                    break
+                changed = set()
+                for e in events:
+                    sample = self._watched.get(e.wd)
+                    changed.add(sample if sample is not None else e.name)
+                with self._lock:
+                    changed = [s for s in changed if s in self._flags]
+                for s in changed:
+                    self._rescan(s)
+            else:
+                self._stop.wait(self.sweep_interval)
+            if time.time() - last_sweep >= self.sweep_interval:
+                self.sweep()
+                last_sweep = time.time()
+
+
+def _mask(event_names):
+    """
+    Combine the inotify event flags by their names
+
+    :param Iterable[str] event_names: names of the inotify_simple.flags
+    :return int: the combined mask
+    """
+    mask = 0
+    for n in event_names:
+        mask |= getattr(inotify_simple.flags, n)
+    return mask
+
+
+def _list_dirs(results_dir):
+    """
+    List the sample folders in the results folder
+
+    :param str results_dir: path to the folder with the sample results folders
+    :return set[str] | None: names of the sample folders, None if the results folder cannot be listed
+    """
+    try:
+        return {e.name for e in os.scandir(results_dir) if e.is_dir()}
+    except OSError:
+        return None
+
+
+def _scan_sample(sample_dir):
+    """
+    Scan the sample folder in a single pass: list the flag files and stat the per-sample results files
+
+    :param str sample_dir: path to the sample results folder
+    :return SampleResults: sorted flag file paths and [size, modification time] of the results files by kind;
+        of the pypiper profile files by file name, under 'profiles'
+    """
+    flags, files = [], dict()
+    try:
+        for e in os.scandir(sample_dir):
+            if e.name.endswith(FLAG_FILE_EXT):
+                if e.is_file():
+                    flags.append(e.path)
+            elif e.name in _KINDS_BY_FILENAME:
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                files[_KINDS_BY_FILENAME[e.name]] = [st.st_size, st.st_mtime]
+            elif e.name.endswith(PROFILE_FILE_SUFFIX):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                # the profile file name depends on the pipeline, several pipelines may have run in the folder
+                files.setdefault("profiles", dict())[e.name] = [st.st_size, st.st_mtime]
+    except OSError:
+        pass
+    return SampleResults(sorted(flags), files)
+
+
+def get_flag_index(p):
+    """
+    Get the running flag index for the project results folder, create and start one if needed.
+    The number of running indexes is bounded, the least recently used ones are stopped.
+
+    :param looper.Project p: project to get the flag index for
+    :return FlagIndex: the flag index
+    """
+    results_dir = p.metadata.results_subdir
+    with _INDEXES_LOCK:
+        try:
+            idx = _INDEXES.pop(results_dir)
+        except KeyError:
+            idx = FlagIndex(results_dir).start()
+        _INDEXES[results_dir] = idx
+        while len(_INDEXES) > FLAG_INDEX_CACHE_SIZE:
+            _, evicted = _INDEXES.popitem(last=False)
+            evicted.stop()
+    return idx
+
+
+def add_change_listener(listener):
+    """
+    Register the callable invoked with the results folder path and each status transition detected by the indexes
+
+    :param callable listener: the listener, it should return quickly
+    """
+    if listener not in _CHANGE_LISTENERS:
+        _CHANGE_LISTENERS.append(listener)
+
+
+def remove_change_listener(listener):
+    """
+    Unregister the status transition listener
+
+    :param callable listener: the listener
+    """
+    if listener in _CHANGE_LISTENERS:
+        _CHANGE_LISTENERS.remove(listener)
+
+
+def find_flag_index(results_dir):
+    """
+    Get the running flag index for the results folder, without creating one
+
+    :param str results_dir: path to the folder with the sample results folders
+    :return FlagIndex | None: the flag index, None if the folder is not indexed
+    """
+    with _INDEXES_LOCK:
+        return _INDEXES.get(results_dir)
+
+
+def flag_names(flag_paths):
+    """
+    Extract the flag names from the flag file paths, e.g. 'completed' out of '<results>/sample/pipeline_completed.flag'
+
+    :param Iterable[str] flag_paths: flag file paths
+    :return list[str]: flag names
+    """
+    return [os.path.splitext(os.path.basename(f))[0].split("_")[-1] for f in flag_paths]
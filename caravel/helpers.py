@@ -3,30 +3,34 @@ from __future__ import print_function
 import globs
 from .const import *
 from .caravel_conf import *
-from .exceptions import MissingCaravelConfigError
-import looper
-import peppy
+from .exceptions import JobCancelledError, MissingCaravelConfigError
+from .flag_index import get_flag_index
+from .metrics import timed
 import argparse
+import copy
+import logging
 import random
+import threading
 import string
 import fcntl
 import termios
 import struct
-import pandas as _pd
+import subprocess
+import tempfile
+import sys
+import time
 from importlib import import_module
 from sys import stderr
 from csv import DictReader
 from flask import current_app, render_template, redirect, url_for, flash
 from re import sub
 from functools import partial
-from looper.html_reports import *
-from looper.looper import Summarizer, get_file_for_project, uniqify, run_custom_summarizers
 from logmuse import setup_logger
-from looper.utils import fetch_sample_flags
 import yacman
 from platform import python_version
 from distutils.version import LooseVersion
 from itertools import chain
+from collections import OrderedDict
 
 
 def get_items(i, l):
@@ -40,21 +44,25 @@ def get_items(i, l):
     return map(l.__getitem__, i)
 
 
-def get_navbar_summary_links():
+def get_navbar_summary_links(ctx):
     """
-    Set the global variable summary_links to the current links HTML string
+    Set the summary_links of the session context to the current links HTML string
 
+    :param caravel.session_context.SessionContext ctx: the session context
     :return str: navbar links HTML
     """
-    if globs.p is not None and globs.summary_requested:
-        reports_dir = get_reports_dir(globs.p)
+    from looper.html_reports import get_reports_dir
+    if ctx.p is not None and ctx.summary_requested:
+        reports_dir = get_reports_dir(ctx.p)
         context = ["summary", os.path.basename(reports_dir)]
-        globs.summary_links = render_navbar_summary_links(globs.p, wd=reports_dir, context=context) \
-            if check_for_summary(globs.p) else SUMMARY_NAVBAR_PLACEHOLDER
+        ctx.summary_links = render_navbar_summary_links(ctx.p, wd=reports_dir, context=context) \
+            if check_for_summary(ctx.p) else SUMMARY_NAVBAR_PLACEHOLDER
     else:
-        globs.summary_links = ""
+        ctx.summary_links = ""
+    return ctx.summary_links
 
 
+@timed
 def compile_results_content(log_path, act):
     """
     Compile the content of the looper results page. Apart from reading the contents of the log file
@@ -74,6 +82,50 @@ def compile_results_content(log_path, act):
     return _color_to_bold(compiled_text)
 
 
+def read_log_tail(log_path, offset=0, window=LOG_TAIL_WINDOW):
+    """
+    Read the part of the log file appended after the selected byte offset and convert it to HTML.
+
+    Only the complete lines are read, so the color markers are never split between the consecutive reads.
+    If there is more new content than the window size, only the last part of it is read.
+
+    :param str log_path: a path to the caravel log file to be read
+    :param int offset: the byte offset the previous read ended at
+    :param int window: max number of bytes to read
+    :return dict | None: the HTML 'content', the new 'offset', the number of the 'skipped' bytes and whether the
+        file was truncated since the previous read ('reset'). None if the file cannot be read
+    """
+    from textile import textile
+    try:
+        size = os.path.getsize(log_path)
+    except (OSError, TypeError):
+        return None
+    reset = offset > size
+    if reset:
+        offset = 0
+    skipped = max(0, size - offset - window)
+    start = offset + skipped
+    try:
+        with open(log_path, "rb") as log:
+            log.seek(start)
+            data = log.read(size - start)
+    except IOError:
+        return None
+    if skipped:
+        # start at the first complete line
+        data = data[data.find(b"\n") + 1:]
+        skipped = size - offset - len(data)
+    last_newline = data.rfind(b"\n")
+    if last_newline >= 0:
+        data = data[:last_newline + 1]
+    elif len(data) < window:
+        # wait for the line to be completed
+        data = b""
+    content = data.decode("utf-8", "replace")
+    return {"content": textile(_color_to_bold(content)) if content.strip() else "",
+            "offset": offset + skipped + len(data), "skipped": skipped, "reset": reset}
+
+
 def _color_to_bold(txt):
     """
     Replace the color markers (from colorama.Fore) with the HTML bold tags
@@ -208,7 +260,8 @@ def parse_config_file():
         cfg_path = DEMO_FILE_PATH
     project_list_path = select_config(config_filepath=cfg_path, config_env_vars=CONFIG_ENV_VAR,
                                       on_missing=lambda fp: MissingCaravelConfigError(fp))
-    cc = CaravelConf(filepath=project_list_path)
+    cc = CaravelConf(filepath=project_list_path,
+                     write_delay=current_app.config.get("config_write_delay", CONFIG_WRITE_DELAY))
     missing_names = [p for p in cc[CFG_PROJECTS_KEY].keys()
                      if not hasattr(cc[CFG_PROJECTS_KEY][p], CFG_PROJECT_NAME_KEY)]
     current_app.logger.debug("Missing project names list: {}".format(str(missing_names)))
@@ -217,29 +270,30 @@ def parse_config_file():
     return cc
 
 
-def select_project(proj_selection_str):
+def select_project(ctx, proj_selection_str):
     """
     Parse the string returned by the index page form. Three strings separated by a semicolon are expected by default.
     If the last one (subproject in our use case) is missing, an empty list is appended to the returned list,
     which is subsequently disregarded by looper.Project.__init__ and no subproject is activated
 
+    :param caravel.session_context.SessionContext ctx: the session context
     :param str proj_selection_str: a string formatted like: "<project_path>;<project_id>;<subproject_name>"
     :return list[str]: separated project, ID and subproject name
     """
 
-    if globs.selected_project is None and proj_selection_str is None:
+    if ctx.selected_project is None and proj_selection_str is None:
         raise TypeError("No selection provided")
     else:
-        if None not in (proj_selection_str, globs.selected_project) and globs.selected_project != proj_selection_str:
-            globs.purge_project_data()
-            globs.summary_links = SUMMARY_NAVBAR_PLACEHOLDER
+        if None not in (proj_selection_str, ctx.selected_project) and ctx.selected_project != proj_selection_str:
+            ctx.purge()
+            ctx.summary_links = SUMMARY_NAVBAR_PLACEHOLDER
             current_app.logger.info("Project data removed")
     try:
         seletion_list = proj_selection_str.split(";")
         return seletion_list if len(seletion_list) > 2 else seletion_list + [list()]
     except AttributeError:
         current_app.logger.debug("The project was not selected, recovering previous one")
-        return globs.selected_project, globs.selected_project_id, globs.current_subproj
+        return ctx.selected_project, ctx.selected_project_id, ctx.current_subproj
 
 
 def write_preferences(preferences_dict):
@@ -248,15 +302,15 @@ def write_preferences(preferences_dict):
 
     :param dict preferences_dict: preferences to be written
     """
-    for preference_name, preference_value in preferences_dict.items():
-        try:
-            if check_insert_data(preference_value, PREFERENCES_NAMES_TYPES[preference_name], preference_name):
-                with globs.cc as x:
+    with globs.cc as x:
+        for preference_name, preference_value in preferences_dict.items():
+            try:
+                if check_insert_data(preference_value, PREFERENCES_NAMES_TYPES[preference_name], preference_name):
                     x.setdefault(CFG_PREFERENCES_KEY, dict())
                     x[CFG_PREFERENCES_KEY][preference_name] = preference_value
-        except KeyError:
-            current_app.logger.warning("Preference '{}' cannot be set. The defined preferences are: {}".
-                                       format(preference_name, ", ".join(PREFERENCES_NAMES_TYPES.keys())))
+            except KeyError:
+                current_app.logger.warning("Preference '{}' cannot be set. The defined preferences are: {}".
+                                           format(preference_name, ", ".join(PREFERENCES_NAMES_TYPES.keys())))
 
 
 def read_preferences():
@@ -285,16 +339,20 @@ def read_preferences():
             _check_apply_pref(globs.cc, pref_name, val_type)
 
 
-def ensure_version(current=V_BY_NAME, required=REQUIRED_V_BY_NAME):
+def ensure_version(current=V_BY_NAME, required=None):
     """
     Loose version assertion.
 
     The distutils.version.LooseVersion objects implement __cmp__ methods that allow for
      comparisons of version strings with letters, like: "0.11.0dev".
 
+    :param dict current: versions in use, by package name
+    :param dict required: required versions, by package name. Read from the requirements file if not provided
     :raise ImportError: if at least one of the versions in use does not meet the requirements
     :return bool: True if all the requested versions match
     """
+    if required is None:
+        required = {k: v for p in REQUIRED_PACKAGES for k, v in get_req_version(p).items()}
     assert all(x in current.keys() for x in required.keys()), \
         "the package names to be checked do not match the required versions dictionary."
     for package in required:
@@ -373,7 +431,7 @@ def project_info_dict(p):
     :return dict: dictionary with project information
     """
     return {"name": p.name, "config_file": p.config_file, "sample_count": p.num_samples,
-             "output_dir": p.metadata.output_dir, "subprojects": _get_sp_txt(globs.p)}
+             "output_dir": p.metadata.output_dir, "subprojects": _get_sp_txt(p)}
 
 
 def random_string(n):
@@ -434,6 +492,37 @@ class CaravelParser(argparse.ArgumentParser):
             dest="demo",
             help="Run caravel with demo data.")
 
+        self.add_argument(
+            "-j", "--job-workers",
+            dest="job_workers",
+            type=int,
+            help="Max number of looper actions run in the background at the same time.", default=JOB_WORKERS)
+
+        self.add_argument(
+            "-w", "--workers",
+            dest="workers",
+            type=int,
+            help="Number of the worker processes to serve caravel with, using gunicorn. "
+                 "If not provided, the development server is used.")
+
+        self.add_argument(
+            "--state-store",
+            dest="state_store",
+            help="Path to the SQLite file the session state is shared by the workers in. "
+                 "If not provided, a file in the temporary directory is used.")
+
+        self.add_argument(
+            "--status-history",
+            dest="status_history",
+            help="Path to the SQLite file the sample status transitions are recorded in. "
+                 "If not provided, ~/.caravel_status_history.sqlite is used.")
+
+        self.add_argument(
+            "--profile-startup",
+            action="store_true",
+            dest="profile_startup",
+            help="Report the import times of the caravel modules and their dependencies and exit.")
+
     def format_help(self):
         """ Add version information to help text. """
         return _version_text() + super(CaravelParser, self).format_help()
@@ -448,6 +537,56 @@ def _version_text():
     return "caravel version: {cv}\nlooper version: {lv}\n".format(cv=V_BY_NAME["caravel"], lv=V_BY_NAME["loopercli"])
 
 
+def profile_startup(deferred=DEFERRED_IMPORTS):
+    """
+    Report the per-package import times of the caravel entry point and of the packages imported on the first use.
+    The imports are timed in a fresh interpreter with the '-X importtime' option (Python 3.7+)
+
+    :param list[str] deferred: names of the packages imported on the first use
+    """
+    marker = "caravel-deferred-imports"
+    code = "import sys, caravel.caravel; sys.stderr.write('{}\\n'); {}".\
+        format(marker, "; ".join("import " + m for m in deferred))
+    start = time.time()
+    out = subprocess.Popen([sys.executable, "-X", "importtime", "-c", code], stderr=subprocess.PIPE,
+                           universal_newlines=True).communicate()[1]
+    wall = time.time() - start
+    sections = out.split(marker)
+    if len(sections) != 2 or "import time:" not in sections[0]:
+        eprint("Import times could not be determined, this requires Python 3.7+:\n{}".format(out))
+        return
+    for title, section in zip(["entry point", "deferred, first use"], sections):
+        by_package, total = _parse_importtime(section)
+        _print_terminal_width("{} imports: {:.0f} ms".format(title, total / 1000.0))
+        for pkg, us in sorted(by_package.items(), key=lambda x: x[1], reverse=True)[:STARTUP_PROFILE_TOP_N]:
+            eprint("{:>10.1f} ms  {:>5.1f}%  {}".format(us / 1000.0, 100.0 * us / (total or 1), pkg))
+    _print_terminal_width("interpreter wall time: {:.0f} ms".format(wall * 1000))
+
+
+def _parse_importtime(txt):
+    """
+    Sum the self import times by top-level package out of the '-X importtime' output
+
+    :param str txt: the output to parse
+    :return (dict[str, int], int): self import times in microseconds by package and the total import time
+    """
+    by_package = dict()
+    total = 0
+    for l in txt.splitlines():
+        fields = l.split("|")
+        if not l.startswith("import time:") or len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0].split(":")[1])
+        except ValueError:
+            # the header line
+            continue
+        pkg = fields[2].strip().split(".")[0]
+        by_package[pkg] = by_package.get(pkg, 0) + self_us
+        total += self_us
+    return by_package, total
+
+
 def _print_terminal_width(txt=None, char="-"):
     """
     Print a line composed of the chars and a text in the middle of the terminal
@@ -493,9 +632,52 @@ def _wrap_func_in_box(func, title):
 
 wrap_func_in_box = partial(_wrap_func_in_box, title="looper log")
 
+_looper_logger = None
+_looper_logger_lock = threading.Lock()
+
+
+class _ThreadFilter(logging.Filter):
+    """ Logging filter that passes only the records logged by the selected thread """
+    def __init__(self, thread_id):
+        super(_ThreadFilter, self).__init__()
+        self.thread_id = thread_id
+
+    def filter(self, record):
+        return record.thread == self.thread_id
+
+
+class _CancelFilter(logging.Filter):
+    """
+    Logging filter that raises JobCancelledError once the job cancellation is requested.
+    looper logs each sample before submitting it, so the action stops between the submissions
+    """
+    def __init__(self, cancel_event):
+        super(_CancelFilter, self).__init__()
+        self.cancel_event = cancel_event
+
+    def filter(self, record):
+        if self.cancel_event.is_set():
+            raise JobCancelledError()
+        return True
+
+
+def _get_looper_logger(logging_lvl):
+    """
+    Get the looper logger, which logs to stderr. Set it up on the first call
+
+    :param int logging_lvl: logging level code
+    :return logging.Logger: the looper logger
+    """
+    global _looper_logger
+    with _looper_logger_lock:
+        if _looper_logger is None:
+            _looper_logger = setup_logger("looper", level=logging_lvl, stream=stderr, plain_format=True)
+    return _looper_logger
+
 
 @wrap_func_in_box
-def run_looper(prj, args, act, log_path, logging_lvl):
+@timed
+def run_looper(prj, args, act, log_path, logging_lvl, ctx=None, compute_package=None, cancel_event=None):
     """
     Prepare and run looper action using the provided arguments
 
@@ -504,8 +686,49 @@ def run_looper(prj, args, act, log_path, logging_lvl):
     :param str act: action to run
     :param str log_path: absolute path to the log file location
     :param int logging_lvl: logging level code
+    :param caravel.session_context.SessionContext ctx: context of the session the action was submitted in
+    :param str compute_package: name of the compute package to submit the jobs with,
+        the project one is used if not provided
+    :param threading.Event cancel_event: the job cancellation request; once set, JobCancelledError is raised
+        at the next message the action logs
+    """
+    # the looper logger is shared by the concurrently run actions, so each one logs to its file only from its thread
+    logger = _get_looper_logger(logging_lvl)
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.addFilter(_ThreadFilter(threading.current_thread().ident))
+    if cancel_event is not None:
+        handler.addFilter(_CancelFilter(cancel_event))
+    logger.addHandler(handler)
+    try:
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelledError()
+        if compute_package is not None:
+            # the Project is shared with the other sessions, so the action is run on a shallow copy of it,
+            # with its own compute config that the package is activated in
+            dcc = copy.deepcopy(prj.dcc)
+            dcc.activate_package(compute_package)
+            prj = copy.copy(prj)
+            prj.dcc = dcc
+        _run_looper_action(prj, args, act, ctx)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def _run_looper_action(prj, args, act, ctx=None):
+    """
+    Run looper action using the provided arguments
+
+    :param looper.project.Project prj: project to execute looper action on
+    :param argparse.Namespace args: set of looper arguments
+    :param str act: action to run
+    :param caravel.session_context.SessionContext ctx: context of the session the action was submitted in,
+        its run and summary flags are updated
     """
-    setup_logger("looper", level=logging_lvl, stream=stderr, logfile=log_path, plain_format=True)
+    import looper.looper
+    import peppy
+    from looper.looper import run_custom_summarizers
     eprint("\nAction: {}\n".format(act))
     # run selected looper action
     with peppy.ProjectContext(prj) as prj:
@@ -513,14 +736,17 @@ def run_looper(prj, args, act, log_path, logging_lvl):
             run = looper.looper.Runner(prj)
             try:
                 run(args, None, rerun=(act == "rerun"))
-                globs.run = True
+                if ctx is not None:
+                    ctx.run = True
             except IOError:
                 raise Exception("{} pipelines_dir: '{}'".format(prj.__class__.__name__, prj.metadata.pipelines_dir))
         if act == "destroy":
-            globs.run = False
+            if ctx is not None:
+                ctx.run = False
             return looper.looper.Destroyer(prj)(args, False)
         if act == "summarize":
-            globs.summary_requested = True
+            if ctx is not None:
+                ctx.summary_requested = True
             run_custom_summarizers(prj)
             _render_summary_pages(prj)
         if act == "check":
@@ -537,14 +763,16 @@ def _render_summary_pages(prj):
     :param looper.Project prj: a project the summary pages should be create for
     :return:
     """
+    from looper.html_reports import HTMLReportBuilder, get_jinja_env, get_reports_dir, render_jinja_template
+    from .summarizer import IncrementalSummarizer
     rep_dir = os.path.basename(get_reports_dir(prj))
     # instantiate the objects needed fot he creation the pages
     j_env = get_jinja_env(TEMPLATES_PATH)
     html_report_builder = HTMLReportBuilder(prj)
-    globs.summarizer = Summarizer(prj)
-    objs = globs.summarizer.objs
-    stats = globs.summarizer.stats
-    columns = globs.summarizer.columns
+    summarizer = IncrementalSummarizer(prj)
+    objs = summarizer.objs
+    stats = summarizer.stats
+    columns = summarizer.columns
     # create navbar links
     links_summary = render_navbar_summary_links(prj, wd=html_report_builder.reports_dir, context=[rep_dir])
     links_reports = render_navbar_summary_links(prj, wd=html_report_builder.reports_dir)
@@ -568,6 +796,8 @@ def use_existing_stats_objs(prj):
     :param looper.Projct prj: the project that the files should be checked for
     :return (list, pandas.DataFrame, list): a pair of read files
     """
+    import pandas as _pd
+    from looper.looper import get_file_for_project, uniqify
     stats_path = get_file_for_project(prj, "stats_summary.tsv")
     objs_path = get_file_for_project(prj, "objs_summary.tsv")
     warn_msg = "Could not read file: '{}'. Creating new '" + stats_path + "' and '" + objs_path + "'"
@@ -595,40 +825,95 @@ def use_existing_stats_objs(prj):
     return stats, objs, columns
 
 
+_navbar_links_cache = OrderedDict()
+_navbar_links_lock = threading.Lock()
+
+
+def _summary_tsv_fingerprint(prj):
+    """
+    Get the sizes and modification times of the project summary TSV files
+
+    :param looper.Project prj: the project to get the fingerprint for
+    :return tuple: the fingerprint, with Nones for the missing files
+    """
+    from looper.looper import get_file_for_project
+    fingerprint = []
+    for f in [get_file_for_project(prj, "stats_summary.tsv"), get_file_for_project(prj, "objs_summary.tsv")]:
+        try:
+            st = os.stat(f)
+            fingerprint.append((st.st_size, st.st_mtime))
+        except OSError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
+@timed
 def render_navbar_summary_links(prj, wd, context=None):
     """
     Render the summary-related links for the navbars in a specific context.
     E.g. for the OG caravel pages or summary page or summary reports pages
 
+    The rendered links are memoized and rendered again only when the summary TSV files change. They are not
+    memoized if there are no summary TSV files, since then they are built from the current results of the samples.
+
     :param looper.Project prj: a project the navbar summary links should be created for
     :param list[str] context: the context for the links
     :return str: html string with the links
     """
     context = context or list()
+    key = (prj.config_file, prj.subproject, wd, tuple(context))
+    fingerprint = _summary_tsv_fingerprint(prj)
+    with _navbar_links_lock:
+        cached = _navbar_links_cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            _navbar_links_cache.move_to_end(key)
+            return cached[1]
+    links = _render_navbar_summary_links(prj, wd, context)
+    if fingerprint == (None, None):
+        return links
+    with _navbar_links_lock:
+        _navbar_links_cache[key] = (fingerprint, links)
+        while len(_navbar_links_cache) > NAVBAR_LINKS_CACHE_SIZE:
+            _navbar_links_cache.popitem(last=False)
+    return links
+
+
+def _render_navbar_summary_links(prj, wd, context):
+    """
+    Render the summary-related links for the navbars in a specific context
+
+    :param looper.Project prj: a project the navbar summary links should be created for
+    :param str wd: the directory the links are relative to
+    :param list[str] context: the context for the links
+    :return str: html string with the links
+    """
+    from looper.html_reports import HTMLReportBuilder
+    from .summarizer import IncrementalSummarizer
     html_report_builder = HTMLReportBuilder(prj)
     data = use_existing_stats_objs(prj)
     if data is not None:
         stats, objs, _ = data
     else:
-        globs.summarizer = Summarizer(prj)
-        objs = globs.summarizer.objs
-        stats = globs.summarizer.stats
+        summarizer = IncrementalSummarizer(prj)
+        objs = summarizer.objs
+        stats = summarizer.stats
     args = dict(objs=objs, stats=stats, wd=wd, context=context, include_status=False)
     links = html_report_builder.create_navbar_links(**args)
     return links
 
 
-def get_sample_flags(p, samples=None):
+def status_appearance(flags):
     """
-    Get samples status dict for the selected sample names.
-    If no samples are specified, flags for all will be searched for.
+    Determine the status table row class and label for the sample flags, the same way the status table does it
 
-    :param looper.Project p: project object
-    :param dict samples: successfully submitted samples
-    :return dict: a dictionary of sample names and the corresponding flags
+    :param list[str] flags: flag names found for the sample
+    :return (str, str): row class and status label
     """
-    samples = samples or list(p.sample_names)
-    return None if p is None else {s: fetch_sample_flags(p, s) for s in samples}
+    if not flags:
+        return "table-danger", "Missing"
+    if len(flags) > 1:
+        return "table-warning", "Multiple"
+    return STATUS_APPEARANCE_BY_FLAG.get(flags[0], ("table-secondary", "Unknown"))
 
 
 def check_if_run(p):
@@ -638,7 +923,7 @@ def check_if_run(p):
     :param looper.Project p: project object
     :return bool: a logical indicating whether the pipeline was run on any of the samples
     """
-    return not all(value == [] for value in get_sample_flags(p).values())
+    return get_flag_index(p).any_flags(p.sample_names)
 
 
 def sample_info_hint(p):
@@ -648,9 +933,23 @@ def sample_info_hint(p):
     :param looper.Project p: project object
     :return str: a HTML formatted info
     """
+    from looper.html_reports import get_reports_dir
     rep_dir = get_reports_dir(p)
     samples_path = os.path.join(rep_dir, "samples.html")
     msg = "<hr><small>To get sample-specific log files {}</small>"
     insert = "see <a href='../summary/{}/samples.html'>samples summary page</a>".format(os.path.basename(rep_dir)) \
         if (check_for_summary(p) and os.path.isfile(samples_path)) else "run <code>looper summarize</code>"
     return msg.format(insert)
+
+
+def write_atomically(path, content):
+    """
+    Write the file via a temporary file and rename
+
+    :param str path: path to the file
+    :param str content: the file content
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.rename(tmp, path)
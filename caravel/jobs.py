@@ -0,0 +1,300 @@
+""" Background execution of the looper actions """
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .const import *
+from .exceptions import JobCancelledError
+from .helpers import random_string
+
+_LOGGER = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_FINAL_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+
+class Job(object):
+    """ A looper action submitted for the background execution """
+    def __init__(self, project, act):
+        """
+        Create the job record
+
+        :param str project: path to the config of the project the action is run for
+        :param str act: name of the looper action
+        """
+        self.id = random_string(JOB_ID_LEN)
+        self.project = project
+        self.act = act
+        self.state = JOB_QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.future = None
+        # set to request the cancellation, the running action checks it between its steps
+        self.cancel_event = threading.Event()
+
+    @property
+    def elapsed(self):
+        """
+        Number of seconds the job has been running for
+
+        :return float | None: elapsed time, None if the job has not been started
+        """
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def to_dict(self):
+        """
+        Get the JSON-serializable job representation
+
+        :return dict: the job data
+        """
+        return {"id": self.id, "project": self.project, "act": self.act, "state": self.state,
+                "submitted": self.submitted, "started": self.started, "finished": self.finished,
+                "elapsed": self.elapsed, "error": self.error}
+
+
+class JobManager(object):
+    """
+    A bounded pool of workers that run the looper actions in the background.
+
+    Actions for different projects run in parallel, the ones for the same project are run one after another:
+    a job is handed to the pool only when the previous job of its project finishes, so the jobs waiting
+    for their turn do not occupy the workers and can be cancelled before they start.
+    The running jobs are cancelled cooperatively: the job function gets the job cancel event and raises
+    JobCancelledError at the next point it checks it at
+    """
+    def __init__(self, app, max_workers=JOB_WORKERS, store=None):
+        """
+        Create the job manager
+
+        :param flask.Flask app: the application, the jobs are run in its context
+        :param int max_workers: max number of the jobs run at the same time
+        :param caravel.state_store.StateStore store: the store the job records are shared with the other worker
+            processes in. If not provided, only the jobs submitted to this manager are known
+        """
+        self.app = app
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        # jobs waiting for the previous job of the same project to finish, by project
+        self._queues = dict()
+        # projects which job is in the pool, queued or running
+        self._active = set()
+        self._closed = False
+        self._watcher = None
+
+    def submit(self, func, project, act, *args, **kwargs):
+        """
+        Schedule the function execution
+
+        :param callable func: the function to run, it is called with the additional 'cancel_event' keyword argument
+            and should raise JobCancelledError if the event is set
+        :param str project: path to the config of the project the action is run for
+        :param str act: name of the looper action
+        :return Job: the submitted job
+        """
+        job = Job(project, act)
+        self._record(job)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            self._queues.setdefault(project, deque()).append((job, func, args, kwargs))
+            if project not in self._active:
+                self._submit_next(project)
+        self._start_watcher()
+        return job
+
+    def get(self, job_id):
+        """
+        Get the job by its ID
+
+        :param str job_id: the job ID
+        :return Job | None: the job, None if not found
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        """
+        List all the jobs known to the manager, oldest first
+
+        :return list[Job]: the jobs
+        """
+        with self._lock:
+            return list(self._jobs.values())
+
+    def describe(self, job_id):
+        """
+        Get the JSON-serializable representation of the job, submitted to this or any other manager sharing the store
+
+        :param str job_id: the job ID
+        :return dict | None: the job data, None if not found
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return None if self.store is None else self.store.get_job(job_id)
+
+    def describe_all(self):
+        """
+        Get the JSON-serializable representations of all the known jobs, oldest first
+
+        :return list[dict]: the jobs data
+        """
+        if self.store is None:
+            return [j.to_dict() for j in self.list_jobs()]
+        return self.store.list_jobs()
+
+    def cancel(self, job_id):
+        """
+        Cancel the job. The queued jobs are removed from the queue right away, the running ones are requested
+        to stop and are cancelled when the action checks the request next time, e.g. before the next submission.
+        The jobs run by the other managers sharing the store are cancelled by their managers, on request
+
+        :param str job_id: the job ID
+        :return bool: whether the job was cancelled or the cancellation was requested
+        """
+        job = self.get(job_id)
+        if job is None:
+            data = None if self.store is None else self.store.get_job(job_id)
+            if data is None or data["state"] in JOB_FINAL_STATES:
+                return False
+            return self.store.request_cancel(job_id)
+        with self._lock:
+            if job.state in JOB_FINAL_STATES:
+                return False
+            queue = self._queues.get(job.project, ())
+            entry = next((e for e in queue if e[0] is job), None)
+            if entry is not None:
+                queue.remove(entry)
+            elif job.future is not None and job.future.cancel():
+                # the next job of the project is not handed to the pool by this one
+                self._submit_next(job.project)
+            else:
+                # picked up by a worker, the state is set when the action stops
+                job.cancel_event.set()
+                return True
+            job.state = JOB_CANCELLED
+            job.finished = time.time()
+        self._record(job)
+        return True
+
+    def shutdown(self, wait=False):
+        """
+        Stop accepting the jobs and cancel the queued ones
+
+        :param bool wait: whether to wait for the running jobs to finish
+        """
+        for job in self.list_jobs():
+            if job.state == JOB_QUEUED:
+                self.cancel(job.id)
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+
+    def _submit_next(self, project):
+        """
+        Hand the next queued job of the project to the pool. Must be called with the lock acquired
+
+        :param str project: path to the config of the project
+        """
+        queue = self._queues.get(project)
+        if not queue or self._closed:
+            self._active.discard(project)
+            self._queues.pop(project, None)
+            return
+        job, func, args, kwargs = queue.popleft()
+        self._active.add(project)
+        job.future = self._executor.submit(self._run, job, func, *args, **kwargs)
+
+    def _run(self, job, func, *args, **kwargs):
+        """
+        Run the job function in the application context and record the outcome
+        """
+        with self._lock:
+            if job.cancel_event.is_set():
+                job.state = JOB_CANCELLED
+                job.finished = time.time()
+                self._submit_next(job.project)
+            else:
+                job.state = JOB_RUNNING
+                job.started = time.time()
+        self._record(job)
+        if job.state == JOB_CANCELLED:
+            return
+        try:
+            with self.app.app_context():
+                func(*args, cancel_event=job.cancel_event, **kwargs)
+        except JobCancelledError:
+            job.state = JOB_CANCELLED
+            _LOGGER.info("Job {} ({}) cancelled".format(job.id, job.act))
+        except Exception as e:
+            job.state = JOB_FAILED
+            job.error = "{}: {}".format(e.__class__.__name__, e)
+            _LOGGER.exception("Job {} ({}) failed".format(job.id, job.act))
+        else:
+            job.state = JOB_COMPLETED
+        finally:
+            job.finished = time.time()
+            self._record(job)
+            with self._lock:
+                self._submit_next(job.project)
+
+    def _record(self, job):
+        """
+        Share the job record with the other managers, if the store is used
+        """
+        if self.store is None:
+            return
+        try:
+            self.store.save_job(job.to_dict())
+        except Exception as e:
+            _LOGGER.warning("Job {} record could not be stored: {}".format(job.id, e))
+
+    def _start_watcher(self):
+        """
+        Start the thread that picks up the cancellation requests from the other managers, if the store is used
+        """
+        with self._lock:
+            if self.store is None or self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch_cancel_requests, name="job-cancel-watcher")
+            self._watcher.daemon = True
+        self._watcher.start()
+
+    def _watch_cancel_requests(self):
+        """
+        Periodically cancel the unfinished jobs whose cancellation was requested via the store
+        """
+        handled = set()
+        while True:
+            time.sleep(JOB_CANCEL_POLL_INTERVAL)
+            pending = [j.id for j in self.list_jobs() if j.state not in JOB_FINAL_STATES and j.id not in handled]
+            try:
+                requested = self.store.cancel_requests(pending)
+            except Exception as e:
+                _LOGGER.warning("Job cancellation requests could not be read: {}".format(e))
+                continue
+            for job_id in requested:
+                _LOGGER.info("Job {} cancellation requested by another worker".format(job_id))
+                self.cancel(job_id)
+                handled.add(job_id)
+
+    def _prune(self):
+        """
+        Forget the oldest finished jobs if there are too many of them. Must be called with the lock acquired
+        """
+        finished = [j.id for j in self._jobs.values() if j.state in JOB_FINAL_STATES]
+        for job_id in finished[:max(0, len(self._jobs) - JOBS_HISTORY_MAX)]:
+            del self._jobs[job_id]
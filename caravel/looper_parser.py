@@ -1,9 +1,28 @@
 """ Interface with looper """
 
 import argparse
+import threading
 from const import SET_ELSEWHERE
 from helpers import *
 
+_parser = None
+_form_schemas = dict()
+_schema_lock = threading.Lock()
+
+
+def get_looper_parser():
+    """
+    Get the looper CLI parser. It is built on the first call and reused afterwards
+
+    :return argparse.ArgumentParser: the looper parser
+    """
+    global _parser
+    with _schema_lock:
+        if _parser is None:
+            from looper.looper import build_parser
+            _parser = build_parser()
+    return _parser
+
 
 def get_positional_args(p, sort=False):
     """
@@ -59,6 +78,9 @@ def get_form_elements_data(parser, project, command=None):
     needed to construct the objects and the dest values.
     See _is_set_elsewhere documentation for the options that are omitted.
 
+    The project-independent part of the data is built once per parser and command and cached,
+    only the project-dependent parameters are resolved on every call.
+
     :param argparse.ArgumentParser parser: the parser to inspect
     :param peppy.Project project: the Project in the context of which the data should be processed
     :param str command: looper command name if no name provided the main parser is used
@@ -66,6 +88,26 @@ def get_form_elements_data(parser, project, command=None):
     :return: html_params: parameters needed for HTML form elements construction
     :rtype: (list, list[dict])
     """
+    html_elements_types, html_args, html_dest, opt_names = get_form_schema(parser, command)
+    html_params = [_html_param_builder(process_type_args(args, project)) for args in html_args]
+    ret_vals_lens = set(map(len, [html_elements_types, html_params, html_dest, opt_names]))
+    assert len(ret_vals_lens) == 1, "The lengths of return lists are not equal, '{}'".format(ret_vals_lens)
+    return [list(html_elements_types), html_params, list(html_dest), list(opt_names)]
+
+
+def get_form_schema(parser, command=None):
+    """
+    Get the project-independent HTML form elements data for the looper parser/subparser: the element types,
+    unprocessed element arguments, dest values and option names. The data is built once per parser and command
+
+    :param argparse.ArgumentParser parser: the parser to inspect
+    :param str command: looper command name if no name provided the main parser is used
+    :return (list[str], list[Mapping], list[str], list[str]): element types, element arguments, dests and option names
+    """
+    key = (id(parser), command)
+    with _schema_lock:
+        if key in _form_schemas:
+            return _form_schemas[key]
     if command is None:
         opts = parser._actions
     else:
@@ -73,7 +115,7 @@ def get_form_elements_data(parser, project, command=None):
         opts = subparser.choices[command]._actions
 
     html_elements_types = []
-    html_params = []
+    html_args = []
     html_dest = []
     opt_names = []
     for opt in opts:
@@ -85,14 +127,13 @@ def get_form_elements_data(parser, project, command=None):
                 type_data = opt.type(caravel=True)
             except TypeError:
                 raise TypeError("The option type is not defined for '{}'".format(str(opt.option_strings)))
-            type = type_data.element_type
-            params = process_type_args(type_data.element_args, project)
-            html_elements_types.append(type)
-            html_params.append(_html_param_builder(params))
+            html_elements_types.append(type_data.element_type)
+            html_args.append(dict(type_data.element_args))
             html_dest.append(opt.dest)
-    ret_vals_lens = set(map(len, [html_elements_types, html_params, html_dest, opt_names]))
-    assert len(ret_vals_lens) == 1, "The lengths of return lists are not equal, '{}'".format(ret_vals_lens)
-    return [html_elements_types, html_params, html_dest, opt_names]
+    schema = (html_elements_types, html_args, html_dest, opt_names)
+    with _schema_lock:
+        _form_schemas[key] = schema
+    return schema
 
 
 def process_type_args(type_args, project):
@@ -102,14 +143,11 @@ def process_type_args(type_args, project):
     The processing is strictly dependant on the class of the particular parameter. For instance,
     if the argument is a str the processed one will be the value of the Project's attribute named this way.
 
-    :param attmap.AttMap type_args: the HTML form arguments from the type object
+    :param Mapping type_args: the HTML form arguments from the type object, not modified
     :param peppy.Project project: the Project in the context of which the data should be processed
     :return dict: the dict with processed values
     """
-    for k, v in type_args.iteritems():
-        if isinstance(v, str):
-            type_args[k] = getattr(project, v)
-    return type_args
+    return {k: getattr(project, v) if isinstance(v, str) else v for k, v in dict(type_args).items()}
 
 
 def form_elements_data_by_type(data):
@@ -0,0 +1,151 @@
+""" Request and function latency metrics, exposed in the Prometheus text format """
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """ Cumulative latency histogram with fixed buckets """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param Iterable[float] buckets: upper bounds of the buckets, in seconds
+        """
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Record the observation
+
+        :param float value: the observed duration, in seconds
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Get the cumulative bucket counts, as reported by Prometheus
+
+        :return list[(str, int)]: the upper bounds of the buckets and the numbers of observations that fit in them
+        """
+        res, total = [], 0
+        for le, n in zip([repr(float(b)) for b in self.buckets] + ["+Inf"], self.counts):
+            total += n
+            res.append((le, total))
+        return res
+
+
+class Metrics(object):
+    """ Thread-safe registry of the request counts and latency histograms """
+    def __init__(self):
+        self._requests = dict()
+        self._request_durations = dict()
+        self._function_durations = dict()
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def observe_request(self, endpoint, method, status, duration):
+        """
+        Record the handled request
+
+        :param str endpoint: the Flask endpoint name
+        :param str method: the HTTP method
+        :param int status: the response status code
+        :param float duration: the request handling time, in seconds
+        """
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._request_durations.setdefault((endpoint, method), Histogram()).observe(duration)
+
+    def observe_function(self, name, duration):
+        """
+        Record the function call
+
+        :param str name: the function name
+        :param float duration: the function execution time, in seconds
+        """
+        with self._lock:
+            self._function_durations.setdefault((name, ), Histogram()).observe(duration)
+
+    def render(self):
+        """
+        Render the metrics in the Prometheus text exposition format
+
+        :return str: the metrics
+        """
+        lines = []
+        with self._lock:
+            lines.extend(["# HELP caravel_uptime_seconds Time since the metrics collection start.",
+                          "# TYPE caravel_uptime_seconds gauge",
+                          "caravel_uptime_seconds {}".format(repr(time.time() - self.started))])
+            lines.extend(["# HELP caravel_requests_total Number of the handled requests.",
+                          "# TYPE caravel_requests_total counter"])
+            for (endpoint, method, status), n in sorted(self._requests.items()):
+                lines.append("caravel_requests_total{} {}".format(
+                    _labels(endpoint=endpoint, method=method, status=status), n))
+            lines.extend(_render_histograms("caravel_request_duration_seconds", "Request handling time.",
+                                            ["endpoint", "method"], self._request_durations))
+            lines.extend(_render_histograms("caravel_function_duration_seconds", "Execution time of the hot spots.",
+                                            ["function"], self._function_durations))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels):
+    """
+    Format the Prometheus labels
+
+    :return str: the labels in curly braces
+    """
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                          for k, v in labels.items()) + "}"
+
+
+def _render_histograms(name, help_txt, label_names, histograms):
+    """
+    Render the histograms in the Prometheus text exposition format
+
+    :param str name: the metric name
+    :param str help_txt: the metric description
+    :param list[str] label_names: names of the labels the histograms are keyed on
+    :param dict[tuple, Histogram] histograms: the histograms
+    :return list[str]: the lines
+    """
+    lines = ["# HELP {} {}".format(name, help_txt), "# TYPE {} histogram".format(name)]
+    for key, h in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        for le, n in h.cumulative():
+            lines.append("{}_bucket{} {}".format(name, _labels(**dict(labels, le=le)), n))
+        lines.append("{}_sum{} {}".format(name, _labels(**labels), repr(h.sum)))
+        lines.append("{}_count{} {}".format(name, _labels(**labels), h.count))
+    return lines
+
+
+METRICS = Metrics()
+
+
+def timed(func):
+    """
+    This decorator records the execution time of the function in the metrics
+
+    :param callable func: function to be decorated
+    :return callable: decorated function
+    """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            METRICS.observe_function(func.__name__, time.perf_counter() - start)
+    return decorated
@@ -0,0 +1,143 @@
+""" Parsing of the per-sample runtime and memory use reported by pypiper in the profile and stats files """
+
+import os
+import re
+
+from .const import *
+
+_DURATION_RE = re.compile(r"^(?:(\d+) days?, )?(\d+):(\d{2}):(\d{2}(?:\.\d+)?)$")
+_MEMORY_RE = re.compile(r"^([0-9.]+)\s*([KMGT]?B?)$", re.IGNORECASE)
+_MEMORY_UNITS_GB = {"": 1.0, "B": 1.0 / 1024 ** 3, "K": 1.0 / 1024 ** 2, "KB": 1.0 / 1024 ** 2, "M": 1.0 / 1024,
+                    "MB": 1.0 / 1024, "G": 1.0, "GB": 1.0, "T": 1024.0, "TB": 1024.0}
+
+
+def parse_duration(value):
+    """
+    Parse the duration reported by pypiper, e.g. '0:01:02', '1 day, 2:00:00' or the number of seconds
+
+    :param str value: the duration
+    :return float | None: number of seconds, None if the value cannot be parsed
+    """
+    value = value.strip()
+    m = _DURATION_RE.match(value)
+    if m:
+        days, h, mins, s = m.groups()
+        return int(days or 0) * 86400 + int(h) * 3600 + int(mins) * 60 + float(s)
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_memory(value):
+    """
+    Parse the memory use reported by pypiper, e.g. '1.5GB', '300 MB' or the number of gigabytes
+
+    :param str value: the memory use
+    :return float | None: number of gigabytes, None if the value cannot be parsed
+    """
+    m = _MEMORY_RE.match(value.strip())
+    if not m:
+        return None
+    try:
+        return float(m.group(1)) * _MEMORY_UNITS_GB[m.group(2).upper()]
+    except (ValueError, KeyError):
+        return None
+
+
+def profile_state(path, inode=None):
+    """
+    Create the read state of the profile file
+
+    :param str path: path to the profile file
+    :param int inode: inode of the file, used to tell if the file was created again
+    :return dict: the state: the read offset, the columns found in the header and the sum of the command runtimes
+        and max memory use read so far
+    """
+    return {"path": path, "inode": inode, "offset": 0, "columns": dict(), "runtime": 0.0, "memory": None}
+
+
+def parse_profile_line(line, state):
+    """
+    Add the command in the pypiper profile line to the sample runtime and peak memory use.
+    The columns are selected by the commented header line, e.g. '# pid  hash  cid  runtime  mem  cmd  lock'
+
+    :param str line: the profile file line
+    :param dict state: the profile file read state, updated in place
+    """
+    if not line.strip():
+        return
+    fields = line.split("\t")
+    if line.startswith("#"):
+        names = [f.strip("# ").lower() for f in fields]
+        for key, aliases in [("runtime", ["runtime", "time"]), ("mem", ["mem", "memory"])]:
+            found = [a for a in aliases if a in names]
+            if found:
+                state["columns"][key] = names.index(found[0])
+        return
+    columns = state["columns"]
+    if "runtime" in columns and columns["runtime"] < len(fields):
+        runtime = parse_duration(fields[columns["runtime"]])
+    else:
+        runtime = next((r for r in (parse_duration(f) for f in fields if ":" in f) if r is not None), None)
+    if runtime is not None:
+        state["runtime"] += runtime
+    if "mem" in columns and columns["mem"] < len(fields):
+        memory = parse_memory(fields[columns["mem"]])
+        if memory is not None and (state["memory"] is None or memory > state["memory"]):
+            state["memory"] = memory
+
+
+def read_profile(state, final=False):
+    """
+    Read the lines appended to the profile file since the previous read
+
+    :param dict state: the profile file read state, see profile_state; updated in place
+    :param bool final: whether the profile is complete, so its last line is read even if not terminated
+    :raise OSError: if the file cannot be read
+    :return dict: the state
+    """
+    size = os.stat(state["path"]).st_size
+    if size > state["offset"]:
+        with open(state["path"], "rb") as f:
+            f.seek(state["offset"])
+            chunk = f.read(size - state["offset"])
+        # the last line may be incomplete, it is read again next time
+        end = len(chunk) if final else chunk.rfind(b"\n") + 1
+        state["offset"] += end
+        for line in chunk[:end].decode("utf-8", "replace").splitlines():
+            parse_profile_line(line, state)
+    return state
+
+
+def read_stats(sample_dir, pipeline, keys):
+    """
+    Get the selected values reported by the pipeline in the sample stats file
+
+    :param str sample_dir: path to the sample results folder
+    :param str pipeline: name of the pipeline, the values reported by any pipeline are used if not provided
+    :param Container[str] keys: the stats keys to get
+    :return dict[str, str]: the values by key, the last reported one is used
+    """
+    values = dict()
+    try:
+        with open(os.path.join(sample_dir, SAMPLE_RESULTS_FILENAMES["stats"])) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if fields[0] in keys and len(fields) > 1 and (len(fields) < 3 or pipeline in [None, fields[2]]):
+                    values[fields[0]] = fields[1]
+    except OSError:
+        pass
+    return values
+
+
+def pipeline_name(flags):
+    """
+    Get the pipeline name out of the flag file path, e.g. 'pipeline' out of '<results>/sample/pipeline_running.flag'
+
+    :param list[str] flags: flag file paths of the sample
+    :return str | None: the pipeline name, None if there are no flags
+    """
+    if not flags:
+        return None
+    return os.path.splitext(os.path.basename(flags[0]))[0].rsplit("_", 1)[0]
@@ -0,0 +1,202 @@
+""" On-demand sampling profiler of all the threads and per-request cProfile capture """
+
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from xml.sax.saxutils import escape
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+# only one sampling session at a time, the samples of concurrent sessions would overlap
+_sampling_lock = threading.Lock()
+
+
+def frame_package(frame):
+    """
+    Determine the package the frame code belongs to
+
+    :param frame frame: the frame
+    :return str: one of PROFILE_PACKAGES or "other"
+    """
+    module = frame.f_globals.get("__name__") or ""
+    top = module.split(".")[0]
+    return top if top in PROFILE_PACKAGES else "other"
+
+
+def _frame_label(frame):
+    """
+    Get the frame label used in the collapsed stacks: package, module and function name
+
+    :param frame frame: the frame
+    :return str: the label
+    """
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or code.co_filename
+    # semicolons separate the frames in the collapsed stacks
+    return "{}`{}:{}".format(frame_package(frame), module, code.co_name).replace(";", ":")
+
+
+def sample_stacks(duration=PROFILE_DEFAULT_SECONDS, interval=PROFILE_SAMPLE_INTERVAL):
+    """
+    Sample the stacks of all the threads, except the sampling one, periodically for the selected time
+
+    :param float duration: number of seconds to sample for
+    :param float interval: number of seconds between the samples
+    :raise RuntimeError: if another sampling session is in progress
+    :return collections.Counter: numbers of samples by collapsed stack, root frame first
+    """
+    if not _sampling_lock.acquire(False):
+        raise RuntimeError("Another profiling session is in progress")
+    try:
+        own = threading.current_thread().ident
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = Counter()
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append("thread:{}".format(names.get(thread_id, thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _sampling_lock.release()
+
+
+def collapsed_stacks(stacks):
+    """
+    Format the stacks in the collapsed format, as consumed by flamegraph.pl and speedscope
+
+    :param collections.Counter stacks: numbers of samples by collapsed stack
+    :return str: one stack per line, followed by the number of samples
+    """
+    return "".join("{} {}\n".format(s, n) for s, n in sorted(stacks.items()))
+
+
+def package_summary(stacks):
+    """
+    Attribute the samples to the packages by the innermost frame that belongs to one of them
+
+    :param collections.Counter stacks: numbers of samples by collapsed stack
+    :return dict[str, int]: numbers of samples by package
+    """
+    summary = Counter()
+    for s, n in stacks.items():
+        frames = s.split(";")[1:]
+        packages = [f.split("`")[0] for f in frames]
+        summary[next((p for p in reversed(packages) if p != "other"), "other")] += n
+    return dict(summary)
+
+
+def flamegraph_svg(stacks, width=PROFILE_SVG_WIDTH, frame_height=PROFILE_SVG_FRAME_HEIGHT):
+    """
+    Render the stacks as an SVG flame graph, the frames are colored by package
+
+    :param collections.Counter stacks: numbers of samples by collapsed stack
+    :param int width: the image width, in pixels
+    :param int frame_height: height of a frame, in pixels
+    :return str: the SVG document
+    """
+    # build the tree of frames: label -> [samples, children]
+    root = [0, dict()]
+    for s, n in stacks.items():
+        root[0] += n
+        node = root
+        for label in s.split(";"):
+            node = node[1].setdefault(label, [0, dict()])
+            node[0] += n
+    total = root[0] or 1
+    rects = []
+
+    def _layout(children, x, depth):
+        for label, (n, grandchildren) in sorted(children.items()):
+            w = float(width) * n / total
+            if w >= PROFILE_SVG_MIN_WIDTH:
+                rects.append((x, depth, w, label, n))
+                _layout(grandchildren, x, depth + 1)
+            x += w
+
+    _layout(root[1], 0.0, 0)
+    depth_max = max([r[1] for r in rects] or [0]) + 1
+    height = depth_max * frame_height
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="monospace" font-size="11">'.
+           format(width, height)]
+    for x, depth, w, label, n in rects:
+        y = height - (depth + 1) * frame_height
+        color = PROFILE_PACKAGE_COLORS.get(label.split("`")[0], PROFILE_PACKAGE_COLORS["other"])
+        text = label.split("`")[-1]
+        out.append('<g><title>{} ({} samples, {:.1f}%)</title>'
+                   '<rect x="{:.1f}" y="{}" width="{:.1f}" height="{}" fill="{}" stroke="white"/>'.
+                   format(escape(text), n, 100.0 * n / total, x, y, w, frame_height - 1, color))
+        n_chars = int((w - 6) / PROFILE_SVG_CHAR_WIDTH)
+        if n_chars >= 3:
+            out.append('<text x="{:.1f}" y="{}">{}</text>'.format(x + 3, y + frame_height - 4, escape(text[:n_chars])))
+        out.append('</g>')
+    out.append('</svg>')
+    return "\n".join(out)
+
+
+class RequestProfiler(object):
+    """
+    Captures the cProfile statistics of the next request to the selected endpoint
+    """
+    def __init__(self):
+        self.endpoint = None
+        self.result = None
+        self._profile = None
+        self._lock = threading.Lock()
+
+    def arm(self, endpoint):
+        """
+        Select the endpoint whose next request is profiled
+
+        :param str endpoint: the Flask endpoint name
+        """
+        with self._lock:
+            self.endpoint = endpoint
+
+    def start(self, endpoint):
+        """
+        Start profiling the request if it is the selected endpoint. Called before the request is handled
+
+        :param str endpoint: the Flask endpoint name of the request
+        :return bool: whether the profiling started
+        """
+        with self._lock:
+            if endpoint is None or endpoint != self.endpoint or self._profile is not None:
+                return False
+            self.endpoint = None
+            self._profile = cProfile.Profile()
+        self._profile.enable()
+        return True
+
+    def stop(self, sort_by=PROFILE_STATS_SORT, lines=PROFILE_STATS_LINES):
+        """
+        Stop profiling and store the formatted statistics. Called after the request is handled
+
+        :param str sort_by: the statistics sort key
+        :param int lines: number of the functions reported
+        """
+        with self._lock:
+            profile, self._profile = self._profile, None
+        if profile is None:
+            return
+        profile.disable()
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats(sort_by).print_stats(lines)
+        self.result = stream.getvalue()
+
+
+REQUEST_PROFILER = RequestProfiler()
@@ -0,0 +1,134 @@
+""" Process-wide cache of the parsed looper Project objects """
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ProjectCache(object):
+    """
+    LRU cache of the looper.Project objects.
+
+    The entries are keyed on the project config path and subproject name. Each one is validated against the
+    modification times of the project config and the sample and subsample tables it was created from,
+    so a change of any of these files results in the Project reload.
+    """
+    def __init__(self, max_size=PROJECT_CACHE_SIZE):
+        """
+        Create the cache
+
+        :param int max_size: max number of the Project objects kept
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, sp=None):
+        """
+        Get the Project object, load it if it is not cached or any of its source files changed
+
+        :param str path: path to the project config file
+        :param str sp: name of the subproject to activate
+        :return looper.Project: the project
+        """
+        key = (os.path.abspath(path), sp or None)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            fingerprint, p = entry
+            if files_fingerprint(source_files(p)) == fingerprint:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                return p
+            _LOGGER.debug("Project source files changed, reloading: {}".format(key))
+        from looper import Project
+        p = Project(path, subproject=sp or None)
+        with self._lock:
+            self._entries[key] = (files_fingerprint(source_files(p)), p)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return p
+
+    def fingerprint(self, p):
+        """
+        Get the fingerprint of the source files the Project object was created from
+
+        :param looper.Project p: the project
+        :return tuple: the fingerprint recorded when the project was cached, the current one if it is not cached
+        """
+        with self._lock:
+            for fingerprint, cached in self._entries.values():
+                if cached is p:
+                    return fingerprint
+        return files_fingerprint(source_files(p))
+
+    def clear(self):
+        """
+        Remove all the cached Project objects
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+def source_files(p):
+    """
+    List the files the Project object was created from: the config and the sample and subsample tables
+
+    :param looper.Project p: the project
+    :return list[str]: paths to the files
+    """
+    files = [p.config_file]
+    for k in PROJECT_TABLE_KEYS:
+        tables = getattr(p.metadata, k, None)
+        if not tables:
+            continue
+        for t in [tables] if isinstance(tables, str) else tables:
+            files.append(t if os.path.isabs(t) else os.path.join(os.path.dirname(p.config_file), t))
+    return files
+
+
+def files_fingerprint(files):
+    """
+    Compose the files fingerprint out of their modification times
+
+    :param Iterable[str] files: paths to the files
+    :return tuple: the fingerprint
+    """
+    fingerprint = []
+    for f in files:
+        try:
+            fingerprint.append((f, os.stat(f).st_mtime))
+        except OSError:
+            fingerprint.append((f, None))
+    return tuple(fingerprint)
+
+
+_CACHE = ProjectCache()
+
+
+def get_project(path, sp=None):
+    """
+    Get the Project object from the process-wide cache
+
+    :param str path: path to the project config file
+    :param str sp: name of the subproject to activate
+    :return looper.Project: the project
+    """
+    return _CACHE.get(path, sp)
+
+
+def project_fingerprint(p):
+    """
+    Get the fingerprint of the source files the Project object was created from, which identifies its content
+
+    :param looper.Project p: the project
+    :return tuple: the fingerprint
+    """
+    return _CACHE.fingerprint(p)
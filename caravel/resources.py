@@ -0,0 +1,278 @@
+""" Per-sample resource usage read from the pypiper profile and stats files, aggregated per project and subproject """
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .const import *
+from .flag_index import FlagIndex, find_flag_index
+from .helpers import write_atomically
+from .pipeline_profile import parse_duration, parse_memory, pipeline_name, profile_state, read_profile, read_stats
+
+_LOGGER = logging.getLogger(__name__)
+
+RESOURCES_COLUMNS = ["sample_name", "pipeline", "wall_time_h", "peak_memory_gb", "cores", "core_hours"]
+# stats keys reported by pypiper (and the pipelines) that the resource usage is read from when there is no profile
+_STATS_KEYS = ["Time", "Peak memory", "Cores"]
+
+_USAGES = OrderedDict()
+_USAGES_LOCK = threading.Lock()
+
+
+class ResourceUsage(object):
+    """
+    Wall time, peak memory use and number of cores of the samples of a results folder.
+
+    The values are read from the pypiper profile files, or the stats files if there are none, and kept with the files
+    fingerprints in a manifest in the results folder, shared by the projects and subprojects that use the folder.
+    The sample folders are scanned in a single threaded pass and only the samples which profile or stats files
+    changed since the previous scan are read again. The scan is repeated at most every RESOURCES_TTL seconds
+    """
+    def __init__(self, results_dir, ttl=RESOURCES_TTL):
+        """
+        :param str results_dir: path to the folder with the sample results folders
+        :param int ttl: number of seconds the scanned values are reused for
+        """
+        self.results_dir = results_dir
+        self.ttl = ttl
+        self.manifest_path = os.path.join(results_dir, RESOURCES_MANIFEST_FILENAME)
+        self._manifest = None
+        self._scanned = OrderedDict()
+        self._table = None
+        self._lock = threading.Lock()
+
+    def table(self, names, refresh=False):
+        """
+        Get the resource usage of the samples
+
+        :param Iterable[str] names: the sample names, e.g. the ones of a project or subproject
+        :param bool refresh: whether the sample folders should be scanned even if the previous scan did not expire
+        :return pandas.DataFrame: the usage of the samples which profile or stats files report it, see RESOURCES_COLUMNS
+        """
+        names = list(names)
+        key = hash(tuple(names))
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = _read_manifest(self.manifest_path)
+            if refresh or time.time() - self._scanned.get(key, 0) > self.ttl:
+                if self._update(names):
+                    self._table = None
+                self._scanned[key] = time.time()
+            # the scan times are kept for the few most recently used sample sets only
+            self._scanned.move_to_end(key)
+            while len(self._scanned) > RESOURCES_SCANS_MAX:
+                self._scanned.popitem(last=False)
+            if self._table is None:
+                self._table = _to_frame(self._manifest)
+            table = self._table
+        return table[table["sample_name"].isin(names)]
+
+    def _update(self, names):
+        """
+        Read the usage of the samples which profile or stats files changed since the previous scan
+        and save the manifest if any did
+
+        :param list[str] names: the sample names
+        :return bool: whether the manifest changed
+        """
+        idx = find_flag_index(self.results_dir) or FlagIndex(self.results_dir)
+        scanned = idx.scan(names)
+        n_read = 0
+        for s in names:
+            res = scanned.get(s)
+            if res is None:
+                continue
+            fingerprint = [res.files.get("stats"), res.files.get("profiles")]
+            entry = self._manifest.get(s)
+            if fingerprint == [None, None]:
+                if entry is not None:
+                    del self._manifest[s]
+                    n_read += 1
+                continue
+            if entry is not None and entry[0] == fingerprint:
+                continue
+            self._manifest[s] = [fingerprint, _read_usage(os.path.join(self.results_dir, s),
+                                                          sorted(res.files.get("profiles", dict())), res.flags)]
+            n_read += 1
+        _LOGGER.info("Resource usage: {} of {} samples read".format(n_read, len(names)))
+        if n_read:
+            try:
+                write_atomically(self.manifest_path, json.dumps(self._manifest))
+            except OSError as e:
+                _LOGGER.warning("Could not save the resource usage manifest: {}".format(e))
+        return n_read > 0
+
+
+def _read_manifest(path):
+    """
+    Read the manifest saved by the previous scan
+
+    :param str path: path to the manifest
+    :return dict: the per-sample entries, empty if the manifest does not exist or cannot be read
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+
+def _read_usage(sample_dir, profiles, flags):
+    """
+    Read the resource usage of the sample. The command runtimes of all the profiles in the folder are summed up
+    and the max memory use is taken; the stats file values are used for the ones the profiles do not provide
+
+    :param str sample_dir: path to the sample results folder
+    :param list[str] profiles: names of the pypiper profile files in the folder
+    :param list[str] flags: flag file paths of the sample
+    :return list: pipeline name, wall time in seconds, peak memory use in gigabytes and number of cores,
+        the ones that are not reported are None
+    """
+    wall_time, memory = None, None
+    for name in profiles:
+        try:
+            state = read_profile(profile_state(os.path.join(sample_dir, name)), final=True)
+        except OSError:
+            continue
+        wall_time = (wall_time or 0.0) + state["runtime"]
+        if state["memory"] is not None:
+            memory = max(memory or 0.0, state["memory"])
+    pipelines = [name[:-len(PROFILE_FILE_SUFFIX)] for name in profiles]
+    stats = read_stats(sample_dir, pipelines[0] if len(pipelines) == 1 else None, _STATS_KEYS)
+    if wall_time is None and "Time" in stats:
+        wall_time = parse_duration(stats["Time"])
+    if memory is None and "Peak memory" in stats:
+        memory = parse_memory(stats["Peak memory"])
+    try:
+        cores = int(float(stats["Cores"]))
+    except (KeyError, ValueError):
+        cores = None
+    return [", ".join(pipelines) or pipeline_name(flags), wall_time, memory, cores]
+
+
+def _to_frame(manifest):
+    """
+    Build the resource usage table out of the manifest
+
+    :param dict manifest: the per-sample entries
+    :return pandas.DataFrame: the usage of the samples, see RESOURCES_COLUMNS
+    """
+    import pandas as pd
+    names = list(manifest.keys())
+    values = [manifest[s][1] for s in names]
+    t = pd.DataFrame(values, columns=["pipeline", "wall_time", "peak_memory_gb", "cores"], dtype=object)
+    t.insert(0, "sample_name", names)
+    t["pipeline"] = t["pipeline"].fillna("")
+    t["wall_time_h"] = pd.to_numeric(t.pop("wall_time"), errors="coerce") / 3600
+    t["peak_memory_gb"] = pd.to_numeric(t["peak_memory_gb"], errors="coerce")
+    t["cores"] = pd.to_numeric(t["cores"], errors="coerce").fillna(RESOURCES_DEFAULT_CORES)
+    t["core_hours"] = t["wall_time_h"] * t["cores"]
+    return t[RESOURCES_COLUMNS]
+
+
+def _protocols(p):
+    """
+    Get the protocols of the project samples
+
+    :param looper.Project p: the project
+    :return dict[str, str]: protocol by sample name
+    """
+    protocols = dict()
+    for s in p.samples:
+        proto = getattr(s, "protocol", None)
+        protocols[s.name] = proto if proto is None or isinstance(proto, str) else ", ".join(proto)
+    return protocols
+
+
+def find_outliers(t, threshold=RESOURCES_OUTLIER_THRESHOLD, min_group_size=RESOURCES_MIN_GROUP_SIZE):
+    """
+    Find the samples which wall time or peak memory use is unusual for their pipeline and protocol.
+    The robust z-score, based on the median and the median absolute deviation, is computed for each group at once
+
+    :param pandas.DataFrame t: the resource usage table, with the 'protocol' column
+    :param float threshold: the min absolute robust z-score of an outlier
+    :param int min_group_size: the outliers are not looked for in the groups with fewer samples
+    :return pandas.DataFrame: the outlier samples with the z-scores, the most unusual first
+    """
+    import pandas as pd
+    keys = [t["pipeline"], t["protocol"].fillna("")]
+    t = t.copy()
+    flagged = pd.Series(False, index=t.index)
+    for col in ["wall_time_h", "peak_memory_gb"]:
+        groups = t[col].groupby(keys)
+        median = groups.transform("median")
+        deviation = (t[col] - median).abs()
+        mad = deviation.groupby(keys).transform("median")
+        z = 0.6745 * (t[col] - median) / mad.where(mad > 0)
+        z[groups.transform("count") < min_group_size] = float("nan")
+        t[col + "_z"] = z
+        flagged |= z.abs() > threshold
+    t = t[flagged]
+    score = t[["wall_time_h_z", "peak_memory_gb_z"]].abs().max(axis=1)
+    return t.loc[score.sort_values(ascending=False).index]
+
+
+def _totals(t):
+    """
+    Sum up the resource usage of the samples
+
+    :param pandas.DataFrame t: the resource usage table
+    :return dict: numbers of the samples, total wall time and core-hours and max peak memory use
+    """
+    return {"samples": int(len(t)), "wall_time_h": _to_float(t["wall_time_h"].sum()),
+            "core_hours": _to_float(t["core_hours"].sum()), "peak_memory_gb": _to_float(t["peak_memory_gb"].max())}
+
+
+def _to_float(v):
+    """
+    Convert the numpy number to a JSON-serializable one
+
+    :param v: the number
+    :return float | None: the number, None if it is missing
+    """
+    return None if v != v else float(v)
+
+
+def resource_report(p, subprojects=None, refresh=False):
+    """
+    Summarize the resource usage of the project: the totals of the project, each subproject and each pipeline
+    and the outlier samples
+
+    :param looper.Project p: the project
+    :param dict[str, dict] subprojects: the subprojects to report the totals of: name, results folder and sample names
+        by subproject name, see caravel.dashboard.Dashboard.describe
+    :param bool refresh: whether the sample folders should be scanned even if the previous scan did not expire
+    :return dict: the report
+    """
+    t = get_resource_usage(p.metadata.results_subdir).table(p.sample_names, refresh=refresh)
+    protocols = _protocols(p)
+    t = t.assign(protocol=t["sample_name"].map(protocols))
+    totals = [dict(_totals(t), name=p.name, subproject=p.subproject)]
+    for sp, description in sorted((subprojects or dict()).items()):
+        st = get_resource_usage(description["results_dir"]).table(description["samples"], refresh=refresh)
+        totals.append(dict(_totals(st), name=description["name"], subproject=sp))
+    by_pipeline = [dict(_totals(g), pipeline=k) for k, g in t.groupby("pipeline")]
+    outliers = find_outliers(t)
+    records = json.loads(outliers.head(RESOURCES_OUTLIERS_MAX).to_json(orient="records"))
+    return {"total_samples": len(p.sample_names), "totals": totals, "by_pipeline": by_pipeline,
+            "outliers": records, "n_outliers": int(len(outliers)), "threshold": RESOURCES_OUTLIER_THRESHOLD,
+            "default_cores": RESOURCES_DEFAULT_CORES}
+
+
+def get_resource_usage(results_dir):
+    """
+    Get the resource usage of the results folder, create one if needed.
+    The number of the kept results folders is bounded, the least recently used ones are dropped
+
+    :param str results_dir: path to the folder with the sample results folders
+    :return ResourceUsage: the resource usage
+    """
+    with _USAGES_LOCK:
+        usage = _USAGES.pop(results_dir, None) or ResourceUsage(results_dir)
+        _USAGES[results_dir] = usage
+        while len(_USAGES) > RESOURCES_TABLES_MAX:
+            _USAGES.popitem(last=False)
+    return usage
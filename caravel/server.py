@@ -0,0 +1,45 @@
+""" Serving caravel with a production WSGI server, in multiple worker processes """
+
+import logging
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def serve(app, port, workers, timeout=WORKER_TIMEOUT, on_exit=None):
+    """
+    Serve the application with gunicorn, which needs to be installed
+
+    The workers are synchronous, each one handles a single request at a time.
+    They are forked after the application is set up, so they share the login token and the preloaded modules
+
+    :param flask.Flask app: the application to serve
+    :param int port: the port to listen on
+    :param int workers: number of the worker processes
+    :param int timeout: number of seconds a worker can handle a request or finish its jobs at shutdown for
+        before it is restarted or killed
+    :param callable on_exit: function called with no arguments in each worker process when it exits
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ImportError("Serving caravel with multiple workers requires 'gunicorn'. "
+                          "Install it using: pip install gunicorn")
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", "0.0.0.0:{}".format(port))
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "sync")
+            self.cfg.set("timeout", timeout)
+            self.cfg.set("graceful_timeout", timeout)
+            if on_exit is not None:
+                self.cfg.set("worker_exit", lambda server, worker: on_exit())
+            self.cfg.set("loglevel", logging.getLevelName(app.logger.getEffectiveLevel()).lower())
+
+        def load(self):
+            return app
+
+    _LOGGER.info("Serving with gunicorn, {} workers".format(workers))
+    _Application().run()
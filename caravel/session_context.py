@@ -0,0 +1,177 @@
+""" Per-session project selection state """
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from flask import g, session
+
+from .const import *
+from .helpers import random_string
+from .project_cache import get_project
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class SessionContext(object):
+    """
+    The project selection state of a single browser session: the selected project and subproject,
+    the looper action and its log file. The Project object is taken from the process-wide project cache
+    """
+    def __init__(self, sid, state=None):
+        """
+        Create the context
+
+        :param str sid: ID of the session
+        :param Mapping state: values of the selection state, see SESSION_STATE_KEYS
+        """
+        self.sid = sid
+        state = state or dict()
+        for k in SESSION_STATE_KEYS:
+            setattr(self, k, state.get(k))
+        self.p = None
+        self.summary_links = None
+        self.snapshot = self.to_dict()
+
+    @property
+    def config_path(self):
+        """
+        Get the expanded path to the config file of the selected project
+
+        :return str: path to the project config file, None if no project is selected
+        """
+        if self.selected_project is None:
+            return None
+        return str(os.path.expandvars(os.path.expanduser(self.selected_project)))
+
+    def load_project(self):
+        """
+        Get the Project object for the selected project and subproject from the project cache
+
+        :return looper.Project | None: the project, None if no project is selected
+        """
+        self.p = None if self.selected_project is None \
+            else get_project(self.config_path, self.current_subproj or None)
+        return self.p
+
+    def purge(self):
+        """
+        Remove the project related data, before the new project/subproject is selected
+        """
+        for k in SESSION_STATE_KEYS:
+            setattr(self, k, None)
+        self.p = None
+        self.summary_links = None
+
+    def to_dict(self):
+        """
+        Get the selection state
+
+        :return dict: the JSON-serializable selection state
+        """
+        return {k: getattr(self, k) for k in SESSION_STATE_KEYS}
+
+
+class ContextRegistry(object):
+    """
+    LRU registry of the session contexts.
+
+    If a state store is used, the selection state is read from it for every request and the changes are written back,
+    so the contexts are shared by the worker processes. Otherwise the contexts are kept in memory
+    """
+    def __init__(self, max_size=SESSION_CONTEXTS_MAX, store=None):
+        """
+        Create the registry
+
+        :param int max_size: max number of the session contexts kept in memory
+        :param caravel.state_store.StateStore store: the store the selection state is shared in
+        """
+        self.max_size = max_size
+        self.store = store
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        """
+        Get the context of the session, create it if it does not exist. The selected Project is reloaded if
+        any of its source files changed
+
+        :param str sid: ID of the session
+        :return SessionContext: the context
+        """
+        if self.store is not None:
+            ctx = SessionContext(sid, self.store.load(sid))
+        else:
+            with self._lock:
+                ctx = self._contexts.get(sid)
+                if ctx is None:
+                    ctx = self._contexts[sid] = SessionContext(sid)
+                self._contexts.move_to_end(sid)
+                while len(self._contexts) > self.max_size:
+                    self._contexts.popitem(last=False)
+        try:
+            ctx.load_project()
+        except Exception as e:
+            _LOGGER.warning("Project '{}' could not be loaded: {}".format(ctx.selected_project, e))
+            ctx.purge()
+        return ctx
+
+    def save(self, ctx):
+        """
+        Store the selection state values changed since the context was read, if the state store is used
+
+        :param SessionContext ctx: the context
+        """
+        state = ctx.to_dict()
+        if self.store is not None:
+            self.store.save(ctx.sid, {k: v for k, v in state.items() if v != ctx.snapshot.get(k)})
+        ctx.snapshot = state
+
+    def drop(self, sid):
+        """
+        Remove the context of the session
+
+        :param str sid: ID of the session
+        """
+        with self._lock:
+            self._contexts.pop(sid, None)
+        if self.store is not None:
+            self.store.save(sid, {k: None for k in SESSION_STATE_KEYS})
+
+
+_registry = ContextRegistry()
+
+
+def init_contexts(store=None):
+    """
+    Set up the process-wide registry of the session contexts
+
+    :param caravel.state_store.StateStore store: the store the selection state is shared in by the worker processes
+    :return ContextRegistry: the registry
+    """
+    global _registry
+    _registry = ContextRegistry(store=store)
+    return _registry
+
+
+def get_contexts():
+    """
+    Get the process-wide registry of the session contexts
+
+    :return ContextRegistry: the registry
+    """
+    return _registry
+
+
+def current_context():
+    """
+    Get the context of the session the current request belongs to. It is read once per request
+
+    :return SessionContext: the context
+    """
+    if "ctx" not in g:
+        if "sid" not in session:
+            session["sid"] = random_string(SESSION_ID_LEN)
+        g.ctx = _registry.get(session["sid"])
+    return g.ctx
@@ -0,0 +1,172 @@
+""" SQLite-backed store of the per-session state, shared by the server worker processes """
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .const import *
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_state (
+    sid TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (sid, key)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+"""
+
+
+class ThreadConnections(object):
+    """
+    Connections to a SQLite database in the WAL mode, one per thread and process.
+    Called to get the connection of the current thread; the connections are not shared with the forked processes
+    """
+    def __init__(self, path, timeout=STATE_STORE_TIMEOUT):
+        """
+        :param str path: path to the database file
+        :param int timeout: number of seconds to wait for the database lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        """
+        Get the connection of the current thread, open one if needed
+
+        :return sqlite3.Connection: the connection
+        """
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+
+class StateStore(object):
+    """
+    Per-session key-value store kept in a local SQLite database.
+
+    Every worker process and thread uses its own connection. The database is in the WAL mode,
+    so the reads of one worker are not blocked by the writes of the others
+    """
+    def __init__(self, path, ttl=STATE_TTL, timeout=STATE_STORE_TIMEOUT):
+        """
+        Create the store, initialize the database if it does not exist and remove the expired sessions
+
+        :param str path: path to the database file
+        :param int ttl: number of seconds the state of an inactive session is kept for
+        :param int timeout: number of seconds to wait for the database lock
+        """
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._conn = ThreadConnections(path, timeout)
+        self._conn().executescript(_SCHEMA)
+        self.prune()
+
+    def load(self, sid):
+        """
+        Get the state of the session
+
+        :param str sid: the session ID
+        :return dict: the stored state, empty for a new session
+        """
+        rows = self._conn().execute("SELECT key, value FROM session_state WHERE sid = ?", (sid, )).fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def save(self, sid, state):
+        """
+        Store the values in the session state, the other keys are left untouched
+
+        :param str sid: the session ID
+        :param Mapping state: the values to store, must be JSON-serializable
+        """
+        if not state:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO session_state (sid, key, value, updated) VALUES (?, ?, ?, ?)",
+                             [(sid, k, json.dumps(v), now) for k, v in state.items()])
+
+    def prune(self):
+        """
+        Remove the state of the sessions and the jobs not updated within the TTL
+        """
+        cutoff = time.time() - self.ttl
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM session_state WHERE sid IN "
+                         "(SELECT sid FROM session_state GROUP BY sid HAVING MAX(updated) < ?)", (cutoff, ))
+            conn.execute("DELETE FROM jobs WHERE updated < ?", (cutoff, ))
+
+    def save_job(self, job):
+        """
+        Store the job record, the cancellation request is preserved
+
+        :param dict job: the job data, as returned by Job.to_dict
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO jobs (id, data, updated) VALUES (?, '', 0)", (job["id"], ))
+            conn.execute("UPDATE jobs SET data = ?, updated = ? WHERE id = ?",
+                         (json.dumps(job), time.time(), job["id"]))
+
+    def get_job(self, job_id):
+        """
+        Get the job record
+
+        :param str job_id: the job ID
+        :return dict | None: the job data, None if not found
+        """
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id, )).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def list_jobs(self):
+        """
+        List the job records, oldest first
+
+        :return list[dict]: the jobs data
+        """
+        rows = self._conn().execute("SELECT data FROM jobs ORDER BY updated").fetchall()
+        return sorted([json.loads(r[0]) for r in rows], key=lambda j: j["submitted"])[-JOBS_HISTORY_MAX:]
+
+    def request_cancel(self, job_id):
+        """
+        Record the job cancellation request, to be picked up by the worker process running the job
+
+        :param str job_id: the job ID
+        :return bool: whether the job exists
+        """
+        conn = self._conn()
+        with conn:
+            return conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id, )).rowcount > 0
+
+    def cancel_requests(self, job_ids):
+        """
+        Select the jobs whose cancellation was requested
+
+        :param Iterable[str] job_ids: IDs of the jobs to check
+        :return set[str]: IDs of the jobs to cancel
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        rows = self._conn().execute("SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({})".
+                                    format(", ".join("?" * len(job_ids))), job_ids).fetchall()
+        return {r[0] for r in rows}
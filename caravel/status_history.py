@@ -0,0 +1,202 @@
+""" SQLite-backed history of the sample status transitions and the throughput time series computed from it """
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .const import *
+from .state_store import ThreadConnections
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transitions (
+    results_dir TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_dir_time ON transitions (results_dir, time);
+"""
+
+
+class StatusHistory(object):
+    """
+    History of the sample status transitions kept in a local SQLite database.
+
+    The transitions are buffered in memory and inserted in batches by a background thread, so recording them
+    does not slow down the flag index. Every worker process and thread uses its own connection
+    """
+    def __init__(self, path=STATUS_HISTORY_PATH, ttl=STATUS_HISTORY_TTL, flush_interval=STATUS_HISTORY_FLUSH_INTERVAL,
+                 timeout=STATE_STORE_TIMEOUT):
+        """
+        Create the history, initialize the database if it does not exist and remove the expired transitions
+
+        :param str path: path to the database file
+        :param int ttl: number of seconds the transitions are kept for
+        :param float flush_interval: number of seconds between the consecutive batched inserts
+        :param int timeout: number of seconds to wait for the database lock
+        """
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self._conn = ThreadConnections(path, timeout)
+        self._conn().executescript(_SCHEMA)
+        self.prune()
+        atexit.register(self.flush)
+
+    def record(self, results_dir, change):
+        """
+        Buffer the status transition, it is inserted with the next batch. Used as the flag index change listener
+
+        :param str results_dir: path to the folder with the sample results folders
+        :param dict change: the transition, with 'sample', 'old' and 'new' flag names and the 'time' it was detected at
+        """
+        with self._lock:
+            self._buffer.append((results_dir, change["sample"], _encode(change["old"]), _encode(change["new"]),
+                                 change.get("time", time.time())))
+            # the flushing thread does not survive the fork of the worker processes
+            if self._flusher_pid != os.getpid():
+                self._flusher_pid = os.getpid()
+                flusher = threading.Thread(target=self._run, name="status-history")
+                flusher.daemon = True
+                flusher.start()
+
+    def flush(self):
+        """
+        Insert the buffered transitions in a single transaction
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        try:
+            with self._conn() as conn:
+                conn.executemany("INSERT INTO transitions (results_dir, sample, old, new, time) VALUES (?, ?, ?, ?, ?)",
+                                 batch)
+        except sqlite3.Error as e:
+            _LOGGER.warning("Could not record {} status transitions: {}".format(len(batch), e))
+
+    def prune(self):
+        """
+        Remove the expired transitions
+        """
+        with self._conn() as conn:
+            conn.execute("DELETE FROM transitions WHERE time < ?", (time.time() - self.ttl, ))
+
+    def transitions(self, results_dir, since=None):
+        """
+        Get the recorded transitions of the samples in the results folder, the buffered ones included
+
+        :param str results_dir: path to the folder with the sample results folders
+        :param float since: the time to get the transitions from, all are returned if not provided
+        :return list[(str, list[str], list[str], float)]: sample name, old and new flag names and time,
+            sorted by time
+        """
+        self.flush()
+        rows = self._conn().execute("SELECT sample, old, new, time FROM transitions "
+                                    "WHERE results_dir = ? AND time >= ? ORDER BY time",
+                                    (results_dir, since or 0)).fetchall()
+        return [(s, _decode(old), _decode(new), t) for s, old, new, t in rows]
+
+    def time_series(self, results_dir, samples=None, since=None, bucket=STATUS_HISTORY_BUCKET):
+        """
+        Compute the throughput time series of the samples in the results folder: the numbers of the samples that
+        started running, completed and failed in each time bucket, the completion rate, failure rate
+        and the mean queue wait, which is the time between the 'waiting' and 'running' flags of a sample
+
+        :param str results_dir: path to the folder with the sample results folders
+        :param Container[str] samples: names of the samples to include, e.g. the ones in a subproject;
+            all if not provided
+        :param float since: the start of the time series, STATUS_HISTORY_WINDOW ago if not provided
+        :param int bucket: length of the time bucket, in seconds
+        :raise ValueError: if the bucket is too short or the series would have too many buckets
+        :return dict: the time bucket length and the series, the buckets in the chronological order
+        """
+        now = time.time()
+        since = since if since is not None else now - STATUS_HISTORY_WINDOW
+        if bucket < STATUS_HISTORY_MIN_BUCKET:
+            raise ValueError("The time bucket has to be at least {} seconds long".format(STATUS_HISTORY_MIN_BUCKET))
+        start = since - since % bucket
+        if (now - start) / bucket > STATUS_HISTORY_MAX_BUCKETS:
+            raise ValueError("The time series would have more than {} buckets, use longer ones".
+                             format(STATUS_HISTORY_MAX_BUCKETS))
+        series = [{"start": start + i * bucket, "started": 0, "completed": 0, "failed": 0, "waits": []}
+                  for i in range(int((now - start) // bucket) + 1)]
+        # the transitions before the window are needed for the queue wait of the samples started in the window
+        rows = self.transitions(results_dir, since=since - STATUS_HISTORY_MAX_WAIT)
+        waiting_since = dict()
+        last = dict()
+        for sample, old, new, t in rows:
+            if samples is not None and sample not in samples:
+                continue
+            # the workers serving the same project detect the same transitions independently
+            prev = last.get(sample)
+            if prev is not None and prev[:2] == (old, new) and t - prev[2] < STATUS_HISTORY_DEDUP_WINDOW:
+                continue
+            last[sample] = (old, new, t)
+            if new == ["waiting"]:
+                waiting_since[sample] = t
+                continue
+            waited = t - waiting_since.pop(sample) if new == ["running"] and sample in waiting_since else None
+            if t < start:
+                continue
+            b = series[min(int((t - start) // bucket), len(series) - 1)]
+            if new == ["running"]:
+                b["started"] += 1
+                if waited is not None:
+                    b["waits"].append(waited)
+            elif new == ["completed"]:
+                b["completed"] += 1
+            elif new == ["failed"]:
+                b["failed"] += 1
+        for b in series:
+            waits = b.pop("waits")
+            b["completion_rate"] = b["completed"] * 3600.0 / bucket
+            b["failure_rate"] = float(b["failed"]) / (b["completed"] + b["failed"]) \
+                if b["completed"] + b["failed"] else None
+            b["queue_wait"] = sum(waits) / len(waits) if waits else None
+        return {"bucket": bucket, "since": since, "series": series}
+
+    def _run(self):
+        """
+        The body of the background thread: insert the buffered transitions and remove the expired ones periodically
+        """
+        pruned = time.time()
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            if time.time() - pruned > STATUS_HISTORY_PRUNE_INTERVAL:
+                pruned = time.time()
+                try:
+                    self.prune()
+                except sqlite3.Error as e:
+                    _LOGGER.warning("Could not remove the expired status transitions: {}".format(e))
+
+
+def _encode(flags):
+    """
+    Encode the flag names for storage
+
+    :param list[str] flags: flag names
+    :return str: comma-separated flag names
+    """
+    return ",".join(flags) if flags is not None else None
+
+
+def _decode(value):
+    """
+    Decode the stored flag names
+
+    :param str value: comma-separated flag names
+    :return list[str]: flag names
+    """
+    return value.split(",") if value else []
@@ -0,0 +1,297 @@
+""" Sample status counts and paginated, sorted and filtered status rows, read from the integer-coded status vector """
+
+import logging
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from .const import *
+from .flag_index import flag_names, get_flag_index
+from .helpers import status_appearance
+from .metrics import timed
+
+_LOGGER = logging.getLogger(__name__)
+
+
+# the sample statuses are stored as positions in this list, so a project state is an array of small integers
+_APPEARANCES = [status_appearance([]), status_appearance(["", ""])] + list(STATUS_APPEARANCE_BY_FLAG.values()) + \
+               [status_appearance([None])]
+_CODES_BY_FLAG = {f: i + 2 for i, f in enumerate(STATUS_APPEARANCE_BY_FLAG.keys())}
+_CODES_BY_LABEL = {label: i for i, (_, label) in enumerate(_APPEARANCES)}
+
+
+def status_row_classes():
+    """
+    Get the status table row classes of the status labels
+
+    :return dict[str, str]: row classes by status label
+    """
+    return {label: row_class for row_class, label in _APPEARANCES}
+
+
+def _status_code(flags):
+    """
+    Encode the sample flags as the status code
+
+    :param list[str] flags: flag names found for the sample
+    :return int: position of the sample status in _APPEARANCES
+    """
+    if not flags:
+        return 0
+    if len(flags) > 1:
+        return 1
+    return _CODES_BY_FLAG.get(flags[0], len(_APPEARANCES) - 1)
+
+
+def _count_codes(codes):
+    """
+    Count the samples by status
+
+    :param array.array codes: the status codes of the samples
+    :return dict[str, int]: numbers of the samples by status label, the statuses with no samples are skipped
+    """
+    return {_APPEARANCES[c][1]: n for c, n in enumerate(codes.count(c) for c in range(len(_APPEARANCES))) if n}
+
+
+def count_statuses(flags):
+    """
+    Count the samples by status
+
+    :param Iterable[list[str]] flags: flag names found for each sample
+    :return dict[str, int]: numbers of the samples by status label, the statuses with no samples are skipped
+    """
+    return _count_codes(array("B", [_status_code(f) for f in flags]))
+
+
+class _ProjectStatuses(object):
+    """
+    The statuses of all the samples of a project at a single flag index version: the flag names
+    and the integer-coded status vector, with the cached views: sorted and filtered sample positions.
+
+    The flags and status codes are not modified once created, the status transitions are applied to a copy
+    """
+    def __init__(self, p, created, version, names, flags, codes=None):
+        """
+        :param looper.Project p: the project
+        :param float created: creation time of the flag index the flags were read from
+        :param int version: the flag index version the flags were read at
+        :param list[str] names: the sample names, in the sample table order
+        :param list[list[str]] flags: the flag names of the samples
+        :param array.array codes: the status codes of the samples, computed from the flags if not provided
+        """
+        self.p = p
+        self.created = created
+        self.version = version
+        self.names = names
+        self.flags = flags
+        self.codes = codes if codes is not None else array("B", [_status_code(f) for f in flags])
+        self.counts = _count_codes(self.codes)
+        self.positions = None
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def read(cls, p, idx):
+        """
+        Read the statuses of all the project samples from the flag index
+
+        :param looper.Project p: the project
+        :param caravel.flag_index.FlagIndex idx: the flag index of the project results folder
+        :return _ProjectStatuses: the statuses
+        """
+        # the version is read first, so the flags changed in the meantime are applied again at the next update
+        version = idx.version
+        names = list(p.sample_names)
+        flags = idx.flags(names)
+        return cls(p, idx.created, version, names, [flag_names(flags[n]) for n in names])
+
+    def update(self, idx):
+        """
+        Apply the status transitions recorded by the flag index since this version.
+        The statuses are read again if the index was replaced, its versions are not comparable with this one
+
+        :param caravel.flag_index.FlagIndex idx: the flag index of the project results folder
+        :return _ProjectStatuses: the updated statuses, self if nothing changed
+        """
+        if idx.created != self.created:
+            return self.read(self.p, idx)
+        version, changes = idx.changes_since(self.version, timeout=0)
+        if changes is None:
+            return self.read(self.p, idx)
+        if self.positions is None:
+            self.positions = {n: i for i, n in enumerate(self.names)}
+        changes = [(self.positions[c["sample"]], c["new"]) for c in changes if c["sample"] in self.positions]
+        if not changes:
+            self.version = version
+            return self
+        flags, codes = list(self.flags), array("B", self.codes)
+        for i, new in changes:
+            flags[i] = new
+            codes[i] = _status_code(new)
+        updated = _ProjectStatuses(self.p, self.created, version, self.names, flags, codes)
+        updated.positions = self.positions
+        return updated
+
+    def appearance(self, i):
+        """
+        Get the status table row class and label of the sample
+
+        :param int i: position of the sample in the sample table
+        :return (str, str): row class and status label
+        """
+        return _APPEARANCES[self.codes[i]]
+
+    def view(self, sort, order, status, prefix):
+        """
+        Get the positions of the samples that match the filters, in the selected order
+
+        :param str sort: the sort key, one of STATUS_SORT_KEYS
+        :param str order: the sort order, 'asc' or 'desc'
+        :param str status: the status label to select the samples with, all are selected if not provided
+        :param str prefix: the sample name prefix to select the samples with, all are selected if not provided
+        :return list[int]: positions of the samples in the sample table
+        """
+        key = (sort, order, status, prefix)
+        with self.lock:
+            if key in self.views:
+                self.views.move_to_end(key)
+                return self.views[key]
+        code = _CODES_BY_LABEL.get(status, -1) if status else None
+        positions = [i for i, n in enumerate(self.names)
+                     if (code is None or self.codes[i] == code) and (not prefix or n.startswith(prefix))]
+        if sort == "status":
+            positions.sort(key=lambda i: (_APPEARANCES[self.codes[i]][1], self.names[i]), reverse=order == "desc")
+        elif sort == "name":
+            positions.sort(key=lambda i: self.names[i], reverse=order == "desc")
+        elif order == "desc":
+            positions.reverse()
+        with self.lock:
+            self.views[key] = positions
+            while len(self.views) > STATUS_VIEWS_MAX:
+                self.views.popitem(last=False)
+        return positions
+
+
+_STATUSES = OrderedDict()
+_STATUSES_LOCK = threading.Lock()
+
+
+@timed
+def _project_statuses(p):
+    """
+    Get the statuses of all the project samples. Once read, they are updated with the status transitions
+    recorded by the flag index, so the flags of all the samples are not read again
+
+    :param looper.Project p: the project
+    :return _ProjectStatuses: the statuses
+    """
+    idx = get_flag_index(p)
+    key = id(p)
+    with _STATUSES_LOCK:
+        entry = _STATUSES.get(key)
+        if entry is not None and entry.p is p:
+            _STATUSES.move_to_end(key)
+        else:
+            entry = None
+    if entry is None:
+        entry = _ProjectStatuses.read(p, idx)
+    elif entry.created != idx.created or entry.version != idx.version:
+        entry = entry.update(idx)
+    else:
+        return entry
+    with _STATUSES_LOCK:
+        current = _STATUSES.get(key)
+        if current is None or current.p is not p or \
+                (current.created, current.version) <= (entry.created, entry.version):
+            _STATUSES[key] = entry
+        while len(_STATUSES) > STATUS_ROWS_CACHE_SIZE:
+            _STATUSES.popitem(last=False)
+    return entry
+
+
+def _find_log_file(sample_dir):
+    """
+    Find the pipeline log file in the sample results folder
+
+    :param str sample_dir: path to the sample results folder
+    :return str: name of the log file, None if there is none
+    """
+    try:
+        return next((e.name for e in sorted(os.scandir(sample_dir), key=lambda e: e.name)
+                     if e.name.endswith(PIPELINE_LOG_SUFFIX) and e.is_file()), None)
+    except OSError:
+        return None
+
+
+@timed
+def status_rows(p, offset=0, limit=STATUS_PAGE_SIZE, sort="index", order="asc", status=None, prefix=None):
+    """
+    Get a page of the sample status rows. The samples can be filtered by the status and sample name prefix
+    and sorted by the name or status. Only the sample folders of the rows on the page are accessed
+
+    :param looper.Project p: the project
+    :param int offset: position of the first row on the page, among the filtered rows
+    :param int limit: max number of the rows on the page, capped by STATUS_PAGE_SIZE_MAX
+    :param str sort: the sort key, one of STATUS_SORT_KEYS; 'index' keeps the sample table order
+    :param str order: the sort order, 'asc' or 'desc'
+    :param str status: the status label to select the samples with, e.g. 'Completed' or 'Missing'
+    :param str prefix: the sample name prefix to select the samples with
+    :raise ValueError: if the sort key or order is not supported
+    :return dict: the rows and the numbers of the samples: in total, matching the filters and by status
+    """
+    if sort not in STATUS_SORT_KEYS:
+        raise ValueError("Unsupported sort key '{}', use one of: {}".format(sort, ", ".join(STATUS_SORT_KEYS)))
+    if order not in ["asc", "desc"]:
+        raise ValueError("Unsupported sort order '{}', use 'asc' or 'desc'".format(order))
+    statuses = _project_statuses(p)
+    positions = statuses.view(sort, order, status or None, prefix or None)
+    offset = min(max(offset, 0), len(positions))
+    limit = min(max(limit, 0), STATUS_PAGE_SIZE_MAX)
+    results_dir = p.metadata.results_subdir
+    rows = []
+    for i in positions[offset:offset + limit]:
+        name = statuses.names[i]
+        row_class, label = statuses.appearance(i)
+        rows.append({"sample": name, "status": label, "row_class": row_class, "flags": statuses.flags[i],
+                     "log": _find_log_file(os.path.join(results_dir, name)) if statuses.flags[i] else None})
+    return {"rows": rows, "offset": offset, "total": len(statuses.names), "filtered": len(positions),
+            "counts": statuses.counts, "version": statuses.version}
+
+
+def samples_with_status(p, labels):
+    """
+    Get the names of the samples in the selected statuses
+
+    :param looper.Project p: the project
+    :param Iterable[str] labels: the status labels, e.g. 'Running'
+    :return dict[str, list[str]]: the sample names by status label
+    """
+    statuses = _project_statuses(p)
+    res = {label: [] for label in labels}
+    selected = {_CODES_BY_LABEL[label]: res[label] for label in res if label in _CODES_BY_LABEL}
+    # a single pass over the status vector, whatever the number of the selected statuses
+    for n, c in zip(statuses.names, statuses.codes):
+        if c in selected:
+            selected[c].append(n)
+    return res
+
+
+@timed
+def status_summary(p, recent=STATUS_RECENT_CHANGES):
+    """
+    Get the numbers of the samples by status and the most recent status transitions,
+    without building the status rows
+
+    :param looper.Project p: the project
+    :param int recent: max number of the recent status transitions to return
+    :return dict: the numbers of the samples in total and by status, the flag index version
+        and the recent transitions, the most recent first
+    """
+    statuses = _project_statuses(p)
+    if statuses.positions is None:
+        statuses.positions = {n: i for i, n in enumerate(statuses.names)}
+    changes = get_flag_index(p).recent_changes(recent, samples=statuses.positions) if recent else []
+    for c in changes:
+        c["row_class"], c["label"] = _APPEARANCES[_status_code(c["new"])]
+    return {"total": len(statuses.names), "counts": statuses.counts, "version": statuses.version, "recent": changes}
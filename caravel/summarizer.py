@@ -0,0 +1,135 @@
+""" Incremental creation of the project stats and objects summaries """
+
+import csv
+import json
+import logging
+import os
+
+import pandas as _pd
+from looper.looper import get_file_for_project, uniqify
+
+from .const import *
+from .flag_index import get_flag_index
+from .helpers import write_atomically
+
+_LOGGER = logging.getLogger(__name__)
+
+OBJS_COLUMNS = ['key', 'filename', 'anchor_text', 'anchor_image', 'annotation']
+
+
+class IncrementalSummarizer(object):
+    """
+    Drop-in replacement of looper.Summarizer, which re-reads only the new or changed per-sample stats and objects files.
+
+    The fingerprints and the contents of the per-sample files are stored in a manifest next to the summary TSV files.
+    The files which size and modification time did not change since the previous summary are not read again.
+    """
+    def __init__(self, prj):
+        """
+        Create the stats and objects summaries and save them to the TSV files
+
+        :param looper.Project prj: the project to summarize
+        """
+        self.prj = prj
+        self.manifest_path = get_file_for_project(prj, SUMMARY_MANIFEST_FILENAME)
+        old_manifest = self._read_manifest()
+        manifest = dict()
+        stats, columns, objs = [], [], []
+        n_read = 0
+        # the results files are found and fingerprinted in a single threaded pass over the sample folders
+        scanned = get_flag_index(prj).scan(prj.sample_names)
+        for sample in prj.samples:
+            sample_dir = os.path.join(prj.metadata.results_subdir, sample.name)
+            old_entry = old_manifest.get(sample.name, dict())
+            entry = dict()
+            files = scanned[sample.name].files if sample.name in scanned else dict()
+            for kind, reader in [("stats", _read_sample_stats), ("objs", _read_sample_objs)]:
+                path = os.path.join(sample_dir, SAMPLE_RESULTS_FILENAMES[kind])
+                fingerprint = files.get(kind)
+                if fingerprint is None:
+                    continue
+                if kind in old_entry and old_entry[kind][0] == fingerprint:
+                    entry[kind] = old_entry[kind]
+                else:
+                    entry[kind] = [fingerprint, reader(path)]
+                    n_read += 1
+            manifest[sample.name] = entry
+            # the sample sheet data is in memory already and may change with the sample table, so it is not cached
+            sample_stats = sample.get_sheet_dict()
+            columns.extend(sample_stats.keys())
+            if "stats" in entry:
+                keys, values = entry["stats"][1]
+                sample_stats.update(zip(keys, values))
+                stats.append(sample_stats)
+                columns.extend(keys)
+            if "objs" in entry:
+                objs.extend(dict(r, sample_name=sample.name) for r in entry["objs"][1])
+        _LOGGER.info("Summary: {} of the per-sample files read, {} reused".
+                     format(n_read, sum(len(e) for e in manifest.values()) - n_read))
+        self.stats = stats
+        self.columns = uniqify(columns)
+        self.objs = _pd.DataFrame(objs, columns=OBJS_COLUMNS + ["sample_name"])
+        self._write_stats()
+        self.objs.to_csv(get_file_for_project(prj, "objs_summary.tsv"), sep="\t")
+        write_atomically(self.manifest_path, json.dumps(manifest))
+
+    def _read_manifest(self):
+        """
+        Read the manifest created by the previous summary
+
+        :return dict: the per-sample entries, empty if the manifest does not exist or cannot be read
+        """
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def _write_stats(self):
+        """
+        Write the stats summary TSV, the same way looper does
+        """
+        with open(get_file_for_project(self.prj, "stats_summary.tsv"), "w") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, delimiter="\t", extrasaction="ignore")
+            writer.writeheader()
+            for row in self.stats:
+                writer.writerow(row)
+
+
+def _read_sample_stats(path):
+    """
+    Read the per-sample stats file. The stats reported by multiple pipelines are prefixed with the pipeline name
+
+    :param str path: path to the stats file
+    :return [list, list]: stats keys and values
+    """
+    t = _pd.read_csv(path, sep="\t", header=None, names=['key', 'value', 'pl'])
+    t.drop_duplicates(subset=['key', 'pl'], keep='last', inplace=True)
+    t.loc[:, 'plkey'] = t['pl'] + ":" + t['key']
+    dupes = t.duplicated(subset=['key'], keep=False)
+    t.loc[dupes, 'key'] = t.loc[dupes, 'plkey']
+    return [t['key'].tolist(), [_to_builtin(v) for v in t['value']]]
+
+
+def _read_sample_objs(path):
+    """
+    Read the per-sample objects file
+
+    :param str path: path to the objects file
+    :return list[dict]: the reported objects
+    """
+    t = _pd.read_csv(path, sep="\t", header=None, names=OBJS_COLUMNS)
+    return [{k: _to_builtin(v) for k, v in r.items()} for r in t.to_dict("records")]
+
+
+def _to_builtin(v):
+    """
+    Convert the pandas/numpy value to a JSON-serializable one
+
+    :param v: the value
+    :return: the converted value, None for the missing ones
+    """
+    if _pd.isnull(v):
+        return None
+    return v.item() if hasattr(v, "item") else v
+
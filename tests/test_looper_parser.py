@@ -0,0 +1,58 @@
+""" Tests of the HTML form data built from the looper parser """
+
+import argparse
+
+import pytest
+
+
+class _TypeData(object):
+    def __init__(self, element_type, element_args):
+        self.element_type = element_type
+        self.element_args = element_args
+
+
+class _Project(object):
+    """ Project stub: every attribute the form arguments refer to is a list of choices """
+    def __getattr__(self, name):
+        return ["{}_a".format(name), "{}_b".format(name)]
+
+
+def _html_type(element_type, element_args):
+    def _type(caravel=False):
+        return _TypeData(element_type, element_args)
+    return _type
+
+
+def test_process_type_args_keeps_the_input():
+    looper_parser = pytest.importorskip("caravel.looper_parser")
+    args = {"choices": "sample_names", "min": 0}
+    processed = looper_parser.process_type_args(args, _Project())
+    assert processed == {"choices": ["sample_names_a", "sample_names_b"], "min": 0}
+    assert args == {"choices": "sample_names", "min": 0}
+
+
+def test_form_elements_data_reused_for_other_projects():
+    looper_parser = pytest.importorskip("caravel.looper_parser")
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers()
+    run = sub.add_parser("run")
+    run.add_argument("--limit", type=_html_type("number", {"min": 0}))
+    run.add_argument("--selector-include", type=_html_type("select", {"choices": "protocols"}))
+    for _ in range(2):
+        types, params, dests, opts = looper_parser.get_form_elements_data(parser, _Project(), "run")
+        assert types == ["number", "select"]
+        assert params == ["min=0", ["protocols_a", "protocols_b"]]
+        assert dests == ["limit", "selector_include"]
+
+
+def test_run_options_render():
+    pytest.importorskip("looper")
+    caravel_app = pytest.importorskip("caravel.caravel")
+    from caravel.looper_parser import form_elements_data_by_type, get_form_elements_data, get_looper_parser
+    data = get_form_elements_data(get_looper_parser(), _Project(), "run")
+    assert data[2], "no options found for 'run'"
+    with caravel_app.app.test_request_context("/"):
+        html = caravel_app.render_template("options.html", grouped_form_data=form_elements_data_by_type(data))
+    assert "action_form" in html
+    for dest in data[2]:
+        assert 'name="{}"'.format(dest) in html